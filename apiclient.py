@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import os
+import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# Shared HTTP client of main.py for the tours API
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '16'))
+API_RETRIES = int(os.getenv('API_RETRIES', '3'))
+API_BACKOFF = float(os.getenv('API_BACKOFF', '0.5'))
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '5'))
+API_READ_TIMEOUT = float(os.getenv('API_READ_TIMEOUT', '60'))
+
+
+class APISession(requests.Session):
+    """requests.Session with a keep-alive connection pool, retries with exponential
+    backoff (connection errors, 429 and 5xx, POST included) and a default timeout."""
+
+    def __init__(self, pool_size=API_POOL_SIZE, retries=API_RETRIES, backoff=API_BACKOFF,
+                 timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT)):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"POST"},
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        # Recorded in metrics as api / '<METHOD> <path>', streamed bodies are not counted
+        with metrics.timed("api", f"{method.upper()} {urlsplit(url).path}", kwargs.get("params")) as call:
+            response = super().request(method, url, **kwargs)
+            call.error = response.status_code >= 500
+            if not kwargs.get("stream"):
+                call.bytes = len(response.content)
+        return response
+
+
+session = APISession()
+
+
+def get(url, **kwargs):
+    return session.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return session.post(url, **kwargs)
+
+
+def run_bounded(fn, items, workers):
+    """Calls fn(item) on a pool of workers threads with at most 2 * workers calls queued,
+    so items can be a lazy generator. Yields the results as they complete."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# Benchmarks every query path at several data sizes and concurrency levels and writes
+# throughput and p50/p95/p99 latencies as JSON:
+#   python3 bench.py --sizes 1000,10000 --concurrency 1,8,32 --output bench.json
+#   python3 bench.py ... --baseline bench.json --threshold 0.25   # exit 1 on regressions
+# Mongo runs the FastAPI routes in-process, on --mongo-uri or on mongomock when no URI
+# is given (pip install -r requirements-dev.txt). Cassandra and Dgraph run only when --cassandra / --dgraph point to a (local,
+# single node) server. The bench database, the bench keyspace and ALL Dgraph data are
+# dropped and reseeded for every size.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import datagen
+from locations import CITY_COORDINATES
+
+BENCH_DB = "tours_bench"
+BENCH_KEYSPACE = "tours_bench"
+
+
+def generate(size, seed):
+    """csvsources-like tour, user and history records of the generated dataset."""
+    idx = np.arange(size, dtype=np.int64)
+    base_date = datagen.DEFAULT_BASE_DATE
+    tours = datagen.tours_frame(seed, idx, base_date)
+    users = datagen.users_frame(seed, idx)
+    history = datagen.history_frame(seed, np.arange(size * 2, dtype=np.int64), size, size, 1.1, base_date)
+    for frame in (tours, history):
+        for column in ("start_date", "end_date"):
+            frame[column] = frame[column].dt.to_pydatetime()
+    return (tours.to_dict("records"), users.to_dict("records"), history.to_dict("records"))
+
+
+def measure(call, keys, requests, concurrency):
+    """Runs call(key) requests times on concurrency threads, keys drawn round robin."""
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            call(keys[i % len(keys)])
+            return time.perf_counter() - start, False
+        except Exception:
+            return time.perf_counter() - start, True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(min(concurrency, requests))))   # warm up
+        start = time.perf_counter()
+        samples = list(executor.map(timed, range(requests)))
+        elapsed = time.perf_counter() - start
+    latencies = np.array([latency for latency, _ in samples]) * 1000
+    return {
+        "requests": requests,
+        "errors": sum(error for _, error in samples),
+        "throughput": requests / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+#################################################################
+#   Stores: each returns {path: (call, keys)} once seeded
+
+def mongo_paths(args, tours, users, history):
+    from fastapi.testclient import TestClient
+    import mongoBack
+    import mongosummary
+    from mongoindexes import ensure_indexes
+    from toursearch import TourSearchIndex, RESULT_FIELDS
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    client.drop_database(BENCH_DB)
+    database = client[BENCH_DB]
+    tour_docs = [{"_id": f"tour-{i}", **tour} for i, tour in enumerate(tours)]
+    database["tours"].insert_many(tour_docs)
+    database["users"].insert_many([{"_id": f"user-{i}", **user} for i, user in enumerate(users)])
+    if args.mongo_uri:
+        ensure_indexes(database, wait=True)
+    mongosummary.rebuild(database)
+
+    # The routes only need these, the lifespan handler (which connects to MONGODB_URI) isn't run
+    app = mongoBack.app
+    app.database = database
+    app.tour_search = TourSearchIndex.from_documents(database["tours"].find({}, RESULT_FIELDS))
+    http = TestClient(app)
+
+    def get(path, params=None):
+        response = http.get(path, params=params)
+        response.raise_for_status()
+
+    ids = [doc["_id"] for doc in random.Random(args.seed).sample(tour_docs, min(len(tour_docs), 1000))]
+    prices = [(p, p + 200) for p in range(100, 1800, 50)]
+    dates = [(f"2025-{m:02d}-01", f"2025-{m + 1:02d}-01") for m in range(1, 12)]
+    prefixes = ["bar", "par", "tok", "new y", "epic", "wild q", "sa"]
+    return {
+        "mongo.tours_page": (lambda _: get("/tours/T", {"limit": 20}), [None]),
+        "mongo.tours_by_price": (lambda p: get("/tours/T", {"min_price": p[0], "max_price": p[1], "sort": "price_per_person", "limit": 20}), prices),
+        "mongo.tours_by_date": (lambda d: get("/tours/T", {"start_date_From": d[0], "start_date_To": d[1], "limit": 20}), dates),
+        "mongo.tour_by_id": (lambda id: get(f"/tours/T/{id}"), ids),
+        "mongo.general_info": (lambda _: get("/tours/T/general_info"), [None]),
+        "mongo.search": (lambda q: get("/tours/T/search", {"q": q}), prefixes),
+        "mongo.users_page": (lambda _: get("/users/U", {"limit": 20}), [None]),
+    }
+
+
+def cassandra_paths(args, tours, users, history):
+    import modelCasandra
+
+    cluster = modelCasandra.create_cluster(args.cassandra.split(','))
+    session = cluster.connect()
+    session.execute(f"DROP KEYSPACE IF EXISTS {BENCH_KEYSPACE}")
+    modelCasandra.create_keyspace(session, BENCH_KEYSPACE, 1)
+    session.set_keyspace(BENCH_KEYSPACE)
+    modelCasandra.create_schema(session)
+    repo = modelCasandra.ToursRepository(session)
+    modelCasandra.load_data(repo, history)
+
+    usernames = sorted({row["username"] for row in history})
+    return {
+        "cassandra.q1_user_info": (repo.get_user_info, usernames),
+        "cassandra.q2_user_history": (lambda username: repo.page_user_history(username, 20), usernames),
+        "cassandra.q3_tours_duration": (lambda duration: repo.page_tours_duration(duration, 20), list(range(1, 8))),
+    }
+
+
+def dgraph_paths(args, tours, users, history):
+    import pydgraph
+    import modelDgraph
+
+    client = pydgraph.DgraphClient(pydgraph.DgraphClientStub(args.dgraph))
+    client.alter(pydgraph.Operation(drop_all=True))
+    modelDgraph.set_schema(client)
+    with contextlib.redirect_stdout(sys.stderr):
+        modelDgraph.load_data(client, tours=tours, users=users)
+    # Measure Dgraph itself, not the result cache
+    modelDgraph.query_cache.maxsize = 0
+    modelDgraph.query_cache.clear()
+
+    rng = random.Random(args.seed)
+    usernames = [user["username"] for user in rng.sample(users, min(len(users), 1000))]
+    tour_names = [tour["tour_name"] for tour in rng.sample(tours, min(len(tours), 1000))]
+    places = list(CITY_COORDINATES.values())
+    return {
+        "dgraph.similar_tours": (lambda name: modelDgraph.similar_tours(client, name), tour_names),
+        "dgraph.friend_tours": (lambda username: modelDgraph.friend_tours(client, username), usernames),
+        "dgraph.follows": (lambda username: modelDgraph.follows(client, username), usernames),
+        "dgraph.recommend_tours": (lambda username: modelDgraph.recommend_tours(client, username, depth=2), usernames),
+        "dgraph.tours_near": (lambda place: modelDgraph.tours_near(client, place[0], place[1], 500), places),
+    }
+
+
+STORES = {"mongo": mongo_paths, "cassandra": cassandra_paths, "dgraph": dgraph_paths}
+
+
+def compare(results, baseline, threshold):
+    """Regressions of results against baseline: failed requests (even if the baseline
+    had as many), p95 latency above (1 + threshold) times or throughput below
+    (1 - threshold) times the baseline run of the same path."""
+    previous = {(r["path"], r["size"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["path"], result["size"], result["concurrency"]))
+        if result["errors"]:
+            regressions.append(f"{result['path']} size {result['size']} x{result['concurrency']}: "
+                               f"errors {before['errors'] if before else 0} -> {result['errors']} "
+                               f"of {result['requests']} requests")
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{result['path']} size {result['size']} x{result['concurrency']}: "
+                               f"p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+        if result["throughput"] < before["throughput"] * (1 - threshold):
+            regressions.append(f"{result['path']} size {result['size']} x{result['concurrency']}: "
+                               f"throughput {before['throughput']:.0f} -> {result['throughput']:.0f} req/s")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput and latency of the Mongo, Cassandra and Dgraph query paths")
+    parser.add_argument("--sizes", default="1000,10000", help="tours / users seeded, comma separated")
+    parser.add_argument("--concurrency", default="1,8,32", help="client threads, comma separated")
+    parser.add_argument("--requests", type=int, default=500, help="requests per path and concurrency level")
+    parser.add_argument("--stores", default="mongo,cassandra,dgraph")
+    parser.add_argument("--paths", default="", help="only the paths containing one of these comma separated strings")
+    parser.add_argument("--mongo-uri", default=os.getenv('BENCH_MONGODB_URI'), help="MongoDB to use instead of mongomock")
+    parser.add_argument("--cassandra", default=os.getenv('BENCH_CASSANDRA_IPS'), help="contact points, Cassandra is skipped without them")
+    parser.add_argument("--dgraph", default=os.getenv('BENCH_DGRAPH_URI'), help="host:port, Dgraph is skipped without it (drops all its data!)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON results file (stdout by default)")
+    parser.add_argument("--baseline", help="previous results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    filters = [f for f in args.paths.split(",") if f]
+    stores = [store for store in args.stores.split(",")
+              if store == "mongo" or getattr(args, store)]
+
+    results = []
+    with open(os.devnull, "w") as devnull:
+        for size in sizes:
+            tours, users, history = generate(size, args.seed)
+            for store in stores:
+                paths = STORES[store](args, tours, users, history)
+                for path, (call, keys) in paths.items():
+                    if filters and not any(f in path for f in filters):
+                        continue
+                    for concurrency in levels:
+                        with contextlib.redirect_stdout(devnull):
+                            result = measure(call, keys, args.requests, concurrency)
+                        result = {"path": path, "size": size, "concurrency": concurrency, **result}
+                        print(f"{path:32} size {size:>8} x{concurrency:<3} {result['throughput']:9.0f} req/s  "
+                              f"p50 {result['p50_ms']:7.2f}  p95 {result['p95_ms']:7.2f}  p99 {result['p99_ms']:7.2f} ms"
+                              f"{'  errors ' + str(result['errors']) if result['errors'] else ''}", file=sys.stderr)
+                        results.append(result)
+
+    report = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "mongo": args.mongo_uri or "mongomock",
+        "requests": args.requests,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            regressions = compare(results, json.load(fd), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import csv
+from datetime import datetime
+
+# Typed records of the data CSVs, parsed once and shared by every store loader.
+# Records are read-only for their consumers: each store builds its own documents.
+CSV_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def read_tours(path="./tours_data.csv"):
+    with open(path, newline='') as fd:
+        for row in csv.DictReader(fd):
+            yield {
+                'tour_name': row['tour_name'],
+                'location': row['location'],
+                'duration_days': int(row['duration_days']),
+                'price_per_person': float(row['price_per_person']),
+                'start_date': datetime.strptime(row['start_date'], CSV_DATE_FORMAT),
+                'max_participants': int(row['max_participants']),
+                'end_date': datetime.strptime(row['end_date'], CSV_DATE_FORMAT),
+            }
+
+
+def read_users(path="./users_data.csv"):
+    with open(path, newline='') as fd:
+        for row in csv.DictReader(fd):
+            yield {
+                'username': row['username'],
+                'age': int(row['age']),
+                'state': row['state'],
+                'real_name': row['real_name'],
+                'email': row['email'],
+            }
+
+
+def read_history(path="./tours_users_df.csv"):
+    """Rows of the history file: the tour taken and the user who took it."""
+    with open(path, newline='') as fd:
+        for row in csv.DictReader(fd):
+            yield {
+                'tour_name': row['tour_name'],
+                'location': row['location'],
+                'duration_days': int(row['duration_days']),
+                'price_per_person': float(row['price_per_person']),
+                'start_date': datetime.strptime(row['start_date'], CSV_DATE_FORMAT),
+                'max_participants': int(row['max_participants']),
+                'end_date': datetime.strptime(row['end_date'], CSV_DATE_FORMAT),
+                'username': row['username'],
+                'age': int(row['age']),
+                'state': row['state'],
+                'real_name': row['real_name'],
+                'email': row['email'],
+            }
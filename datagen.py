@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# Synthetic tours_data / users_data / tours_users_df (history) / friends_data datasets
+# at any size, the generator of Random_Tour_csv.ipynb scaled up:
+#   python3 datagen.py --tours 1000000 --users 500000 --history 5000000 --out data/
+# Every attribute of tour i and user i is a hash of (seed, i), so the output depends only
+# on the seed and the sizes (not on the chunk size or the number of processes) and the
+# history rows carry the same attributes as the tours and users files. Chunks are built
+# on a process pool and written in order, keeping memory bounded whatever the size.
+import argparse
+import os
+import time
+from collections import deque
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from csvsources import CSV_DATE_FORMAT
+from locations import CITY_COORDINATES
+
+ADJECTIVES = [
+    "Amazing", "Beautiful", "Epic", "Grand", "Hidden", "Adventurous",
+    "Mysterious", "Breathtaking", "Majestic", "Enchanted", "Serene",
+    "Legendary", "Untamed", "Timeless", "Stunning", "Vibrant",
+    "Wild", "Daring", "Uncharted", "Glorious", "Mystical",
+    "Glistening", "Radiant", "Exhilarating", "Incredible", "Fantastic",
+]
+NOUNS = [
+    "Adventure", "Expedition", "Journey", "Experience", "Trail",
+    "Escape", "Discovery", "Odyssey", "Quest", "Voyage", "Saga",
+    "Exploration", "Trek", "Realm", "Encounter", "Ascent",
+    "Conquest", "Horizon", "Path", "Mission", "Excursion",
+    "Venture", "Legacy", "Challenge", "Pursuit",
+]
+LOCATIONS = list(CITY_COORDINATES)
+PREFIXES = [
+    "cool", "smart", "happy", "fast", "pro", "super", "mega", "neo", "semi",
+    "ninja", "epic", "wild", "legend", "cyber", "atomic", "ultra", "dark",
+    "mighty", "stealth", "xtreme", "rapid", "power", "future", "tech",
+    "brave", "mystic", "swift", "thunder", "supernova", "alpha", "elite",
+    "glitch", "storm", "max", "king", "boss",
+]
+SUFFIXES = [
+    "hero", "master", "genius", "dev", "ninja", "you", "king", "champ", "boss",
+    "guru", "x", "y", "z", "elite", "ace", "pro", "god", "hacker", "wizard",
+    "warrior", "champion", "quest", "titan", "soul", "shooter", "viper", "zero",
+    "one", "savage", "vortex", "gamer", "spark", "force", "snipe", "blaze", "storm",
+]
+FIRST_NAMES = [
+    "Ali", "Eli", "Diego", "Giselle", "Gissele", "Janetzy", "Albaro",
+    "Salome", "Tristan", "Sofia", "Karla", "Mateo", "Valeria", "Camila",
+    "Andres", "Mariana", "Lucia", "Fernando", "Emiliano", "Isabella", "Javier",
+    "Ana", "Dario", "Renata", "Hugo", "Victoria", "Oliver", "Gabriel", "Bianca",
+    "Samuel", "Daniela", "Sebastian", "Claudia", "Nicolas", "Elena", "Leandro",
+    "Alma", "Ivanna", "Ricardo", "Noah", "Manuel", "Adriana",
+]
+LAST_NAMES = [
+    "Tino", "Rios", "Alvarado", "Nieto", "Gomez", "Aguilar", "Flores",
+    "Hernandez", "Lopez", "Martinez", "Perez", "Rodriguez", "Sanchez", "Vargas",
+    "Castro", "Ortiz", "Ruiz", "Ramirez", "Cruz", "Torres", "Morales", "Vega",
+    "Gutierrez", "Mendoza", "Jimenez", "Navarro", "Garcia", "Diaz", "Reyes",
+    "Silva", "Campos", "Valencia", "Fuentes", "Cabrera", "Pineda", "Mejia",
+    "Acosta", "Orozco", "Romero", "Chavez", "Serrano", "Padilla", "Delgado",
+]
+DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "live.com"]
+STATES = [
+    "California", "Texas", "New York", "Florida", "Illinois", "Nevada",
+    "Oregon", "Arizona", "Colorado", "Washington", "Georgia", "North Carolina",
+    "Michigan", "Ohio", "Pennsylvania", "Virginia", "Tennessee", "Massachusetts",
+    "Indiana", "Missouri", "Wisconsin", "North Dakota", "South Carolina",
+    "Alabama", "Louisiana", "Kentucky", "Maine", "New Jersey",
+    "Minnesota", "Connecticut", "Iowa", "Kansas", "Arkansas",
+    "Utah", "West Virginia", "Hawaii", "Idaho", "Montana",
+    "Wyoming", "Delaware", "Alaska", "Nebraska", "Rhode Island",
+]
+
+TOUR_COLUMNS = ["tour_name", "location", "duration_days", "price_per_person", "start_date", "max_participants", "end_date"]
+USER_COLUMNS = ["username", "age", "state", "real_name", "email"]
+FRIEND_COLUMNS = ["username", "friend"]
+
+# Separate hash streams per table / attribute
+TOURS, USERS, HISTORY, FRIENDS = 1, 2, 3, 4
+DEFAULT_BASE_DATE = "2025-01-01"
+DEFAULT_CHUNK_SIZE = 100000
+
+_M64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _hash(seed, stream, field, idx):
+    """splitmix64 of (seed, stream, field, idx), vectorized over the uint64 array idx."""
+    with np.errstate(over='ignore'):
+        z = idx.astype(np.uint64) + np.uint64((seed * 1000003 + stream * 8191 + field * 131) & 0xFFFFFFFFFFFFFFFF) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (z ^ (z >> np.uint64(31))) & _M64
+
+
+def _pick(values, h):
+    return np.asarray(values, dtype=object)[(h % np.uint64(len(values))).astype(np.int64)]
+
+
+def _uniform(h):
+    return (h >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def _join(*parts):
+    result = parts[0].astype(str)
+    for part in parts[1:]:
+        result = np.char.add(result, part.astype(str))
+    return result
+
+
+def tours_frame(seed, idx, base_date):
+    h = lambda field: _hash(seed, TOURS, field, idx)
+    duration = (1 + h(4) % np.uint64(7)).astype(np.int64)
+    start = (np.datetime64(base_date, 'us')
+             + (1 + h(5) % np.uint64(364)).astype('timedelta64[D]')
+             + (h(6) % np.uint64(86400 * 10**6)).astype('timedelta64[us]'))
+    # Numbered so that names are unique (Dgraph and the summaries key tours by name)
+    names = _join(_pick(ADJECTIVES, h(1)), np.full(len(idx), " "), _pick(NOUNS, h(2)), np.full(len(idx), " "), idx)
+    return pd.DataFrame({
+        "tour_name": names,
+        "location": _pick(LOCATIONS, h(3)),
+        "duration_days": duration,
+        "price_per_person": np.round(100 + 1900 * _uniform(h(7)), 2),
+        "start_date": start,
+        "max_participants": (5 + h(8) % np.uint64(45)).astype(np.int64),
+        "end_date": start + duration.astype('timedelta64[D]'),
+    }, columns=TOUR_COLUMNS)
+
+
+def usernames(seed, idx):
+    h = lambda field: _hash(seed, USERS, field, idx)
+    return _join(_pick(PREFIXES, h(1)), np.full(len(idx), "_"), _pick(SUFFIXES, h(2)), idx)
+
+
+def users_frame(seed, idx):
+    h = lambda field: _hash(seed, USERS, field, idx)
+    names = usernames(seed, idx)
+    return pd.DataFrame({
+        "username": names,
+        "age": (18 + h(3) % np.uint64(52)).astype(np.int64),
+        "state": _pick(STATES, h(4)),
+        "real_name": _join(_pick(FIRST_NAMES, h(5)), np.full(len(idx), " "), _pick(LAST_NAMES, h(6))),
+        "email": _join(names, np.full(len(idx), "@"), _pick(DOMAINS, h(7))),
+    }, columns=USER_COLUMNS)
+
+
+def skewed(u, n, skew):
+    """Ids in [0, n) for the uniforms u following a truncated power law of exponent skew:
+    0 is uniform, ~1 and above concentrate on the lowest ids (popular tours, hub users)."""
+    if skew <= 0:
+        return np.minimum((u * n).astype(np.int64), n - 1)
+    if abs(skew - 1) < 1e-9:
+        ranks = np.exp(u * np.log(n + 1))
+    else:
+        ranks = ((np.power(n + 1.0, 1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+    return np.clip(ranks.astype(np.int64) - 1, 0, n - 1)
+
+
+def history_frame(seed, idx, n_tours, n_users, tour_skew, base_date):
+    tours = tours_frame(seed, skewed(_uniform(_hash(seed, HISTORY, 1, idx)), n_tours, tour_skew), base_date)
+    users = users_frame(seed, (_hash(seed, HISTORY, 2, idx) % np.uint64(n_users)).astype(np.int64))
+    return pd.concat([tours, users], axis=1)
+
+
+# Friends per user are capped below 2 ** FRIEND_BITS
+FRIEND_BITS = 20
+
+
+def friends_frame(seed, idx, n_users, avg_friends, user_skew):
+    """Friend edges of the users idx, a geometric number of avg_friends on average each,
+    targets drawn with user_skew so a few hub users collect most of the incoming edges."""
+    u = np.maximum(_uniform(_hash(seed, FRIENDS, 1, idx)), 1e-12)
+    degrees = np.minimum(np.floor(np.log(u) / np.log(avg_friends / (1 + avg_friends))), (1 << FRIEND_BITS) - 1).astype(np.int64)
+    sources = np.repeat(idx, degrees)
+    # k-th edge of each source
+    ordinals = np.arange(len(sources)) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    edge_ids = (sources << FRIEND_BITS) + ordinals
+    targets = skewed(_uniform(_hash(seed, FRIENDS, 2, edge_ids)), n_users, user_skew)
+    targets = np.where(targets == sources, (targets + 1) % n_users, targets)
+    return pd.DataFrame({"username": usernames(seed, sources), "friend": usernames(seed, targets)}, columns=FRIEND_COLUMNS)
+
+
+def _chunk(task):
+    table, chunk, start, stop, opts = task
+    idx = np.arange(start, stop, dtype=np.int64)
+    if table == "tours":
+        frame = tours_frame(opts["seed"], idx, opts["base_date"])
+    elif table == "users":
+        frame = users_frame(opts["seed"], idx)
+    elif table == "history":
+        frame = history_frame(opts["seed"], idx, opts["tours"], opts["users"], opts["tour_skew"], opts["base_date"])
+    else:
+        frame = friends_frame(opts["seed"], idx, opts["users"], opts["friends"], opts["user_skew"])
+    if opts["format"] == "csv":
+        return len(frame), frame.to_csv(index=False, header=chunk == 0, date_format=CSV_DATE_FORMAT).encode()
+    return len(frame), frame
+
+
+class _CSVWriter:
+    def __init__(self, path):
+        self.fd = open(path, "wb")
+
+    def write(self, data):
+        self.fd.write(data)
+
+    def close(self):
+        self.fd.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("--format parquet needs pyarrow (pip install pyarrow)")
+        self.pyarrow = pyarrow
+        self.path = path
+        self.writer = None
+
+    def write(self, frame):
+        # One row group per chunk
+        table = self.pyarrow.Table.from_pandas(frame, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def generate(table, rows, path, pool, opts, chunk_size=DEFAULT_CHUNK_SIZE, in_flight=4):
+    """Writes rows of table to path, chunk_size rows per task with at most in_flight
+    tasks pending per worker. Returns the number of rows written."""
+    tasks = ((table, chunk, start, min(start + chunk_size, rows), opts)
+             for chunk, start in enumerate(range(0, rows, chunk_size)))
+    writer = _CSVWriter(path) if opts["format"] == "csv" else _ParquetWriter(path)
+    pending = deque()
+    written = 0
+    started = time.perf_counter()
+    try:
+        for task in tasks:
+            pending.append(pool.apply_async(_chunk, (task,)))
+            if len(pending) >= in_flight:
+                count, data = pending.popleft().get()
+                writer.write(data)
+                written += count
+        while pending:
+            count, data = pending.popleft().get()
+            writer.write(data)
+            written += count
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - started
+    print(f"{path}: {written} rows in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f} rows/s)")
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deterministic synthetic tours, users, history and friends datasets")
+    parser.add_argument("--tours", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=10000, help="rows of tours_users_df (user took tour)")
+    parser.add_argument("--friends", type=float, default=3, help="average friends per user, 0 to skip friends")
+    parser.add_argument("--tour-skew", type=float, default=1.1, help="power law exponent of the tours taken (0 = uniform)")
+    parser.add_argument("--user-skew", type=float, default=1.1, help="power law exponent of the friend targets (0 = uniform)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-date", default=DEFAULT_BASE_DATE, help="tours start within the year after it")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--out", default=".", help="output directory")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    try:
+        datetime.fromisoformat(args.base_date)
+    except ValueError:
+        parser.error(f"Invalid --base-date {args.base_date}")
+    if args.tours <= 0 or args.users <= 1:
+        parser.error("--tours must be positive and --users at least 2")
+    os.makedirs(args.out, exist_ok=True)
+    opts = {
+        "seed": args.seed, "base_date": args.base_date, "format": args.format,
+        "tours": args.tours, "users": args.users, "friends": args.friends,
+        "tour_skew": args.tour_skew, "user_skew": args.user_skew,
+    }
+    outputs = [
+        ("tours", args.tours, "tours_data"),
+        ("users", args.users, "users_data"),
+        ("history", args.history, "tours_users_df"),
+    ]
+    if args.friends > 0:
+        outputs.append(("friends", args.users, "friends_data"))
+    with Pool(args.workers) as pool:
+        for table, rows, name in outputs:
+            path = os.path.join(args.out, f"{name}.{args.format}")
+            generate(table, rows, path, pool, opts, args.chunk_size, in_flight=2 * args.workers)
@@ -3,6 +3,8 @@ import json
 import csv
 import pydgraph
 
+import modelDgraph
+
 def set_schema(client):
     schema = """
     type User {
@@ -36,10 +38,10 @@ def set_schema(client):
     }
 
     tour_name: string @index(exact) . 
-    location: geo .  # Aseguramos compatibilidad con el tipo geo
+    location: geo @index(geo) .  # Aseguramos compatibilidad con el tipo geo
     duration_days: int .
-    price_per_person: float .
-    start_date: datetime .
+    price_per_person: float @index(float) .
+    start_date: datetime @index(hour) .
     end_date: datetime .
     max_participants: int .
     participants: [uid] .
@@ -181,3 +183,14 @@ def get_follows(client, username):
             print(f"Followers and followings for {username}: {json.dumps(data, indent=2)}")
     except Exception as e:
         print(f"Error al obtener relaciones de usuario: {e}")
+
+def tours_near(client, latitude, longitude, radius_km, min_price=None, max_price=None,
+               start_from=None, start_to=None, first=modelDgraph.DGRAPH_PAGE_SIZE):
+    # location holds the GeoJSON point of the tour in this schema
+    return modelDgraph.tours_near(client, latitude, longitude, radius_km, min_price, max_price,
+                                  start_from, start_to, first, predicate='location')
+
+def tours_within(client, polygon, min_price=None, max_price=None,
+                 start_from=None, start_to=None, first=modelDgraph.DGRAPH_PAGE_SIZE):
+    return modelDgraph.tours_within(client, polygon, min_price, max_price,
+                                    start_from, start_to, first, predicate='location')
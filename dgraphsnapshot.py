@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pydgraph
+
+import modelDgraph
+
+# Nodes fetched per query while exporting the graph
+SNAPSHOT_PAGE_SIZE = int(os.getenv('DGRAPH_SNAPSHOT_PAGE_SIZE', '10000'))
+
+EXPORT_USERS = """{
+    nodes(func: has(username), first: %d%s) {
+        uid
+        friends { uid }
+        tours { uid }
+    }
+}"""
+
+EXPORT_TOURS = """{
+    nodes(func: has(tour_name), first: %d%s) {
+        uid
+        participants { uid }
+        similar_tours { uid }
+    }
+}"""
+
+
+class CSR:
+    """Adjacency of an edge type in compressed sparse row form: the targets of row i
+    are indices[indptr[i]:indptr[i + 1]]."""
+
+    def __init__(self, indptr, indices, n_targets):
+        self.indptr = indptr
+        self.indices = indices
+        self.n_targets = n_targets
+
+    @classmethod
+    def from_edges(cls, src, dst, n_rows, n_targets):
+        order = np.argsort(src, kind='stable')
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_rows), out=indptr[1:])
+        return cls(indptr, dst[order].astype(np.int32), n_targets)
+
+    @property
+    def n_rows(self):
+        return len(self.indptr) - 1
+
+    def out_degree(self):
+        return np.diff(self.indptr)
+
+    def in_degree(self):
+        return np.bincount(self.indices, minlength=self.n_targets)
+
+    def rows(self):
+        # Source row of every edge, aligned with indices
+        return np.repeat(np.arange(self.n_rows, dtype=np.int32), self.out_degree())
+
+
+class Snapshot:
+    """Users and tours with integer ids (their position in user_uids / tour_uids) and the
+    friends, tours, participants and similar_tours edges as CSR arrays."""
+
+    def __init__(self, user_uids, tour_uids, friends, tours, participants, similar_tours):
+        self.user_uids = user_uids
+        self.tour_uids = tour_uids
+        self.friends = friends
+        self.tours = tours
+        self.participants = participants
+        self.similar_tours = similar_tours
+
+    @classmethod
+    def from_dgraph(cls, client, page_size=SNAPSHOT_PAGE_SIZE):
+        user_uids, user_edges = _export(client, EXPORT_USERS, ('friends', 'tours'), page_size)
+        tour_uids, tour_edges = _export(client, EXPORT_TOURS, ('participants', 'similar_tours'), page_size)
+        users, tours = _sorted_ids(user_uids), _sorted_ids(tour_uids)
+        return cls(
+            [_uid(u) for u in user_uids], [_uid(t) for t in tour_uids],
+            _csr(user_edges['friends'], users, users),
+            _csr(user_edges['tours'], users, tours),
+            _csr(tour_edges['participants'], tours, users),
+            _csr(tour_edges['similar_tours'], tours, tours),
+        )
+
+
+def _uid(value):
+    return hex(int(value))
+
+
+def _export(client, query, predicates, page_size):
+    """Pages through the nodes of query by uid. Returns their uids and, per predicate,
+    the (source, target) uid pairs as integer arrays."""
+    uids = []
+    edges = {predicate: ([], []) for predicate in predicates}
+    after = ""
+    while True:
+        res = client.txn(read_only=True).query(query % (page_size, after))
+        nodes = json.loads(res.json).get('nodes', [])
+        for node in nodes:
+            uid = int(node['uid'], 16)
+            uids.append(uid)
+            for predicate in predicates:
+                targets = [int(target['uid'], 16) for target in node.get(predicate, [])]
+                edges[predicate][0].extend([uid] * len(targets))
+                edges[predicate][1].extend(targets)
+        if len(nodes) < page_size:
+            break
+        after = f", after: {nodes[-1]['uid']}"
+    return np.array(uids, dtype=np.uint64), {
+        predicate: (np.array(src, dtype=np.uint64), np.array(dst, dtype=np.uint64))
+        for predicate, (src, dst) in edges.items()
+    }
+
+
+def _sorted_ids(uids):
+    # (sorted uids, their integer ids) to map uids with searchsorted
+    order = np.argsort(uids)
+    return uids[order], order.astype(np.int32)
+
+
+def _csr(edges, sources, targets):
+    src, dst = edges
+    src_ids, keep_src = _lookup(src, sources)
+    dst_ids, keep_dst = _lookup(dst, targets)
+    keep = keep_src & keep_dst
+    return CSR.from_edges(src_ids[keep], dst_ids[keep], len(sources[0]), len(targets[0]))
+
+
+def _lookup(uids, ids):
+    # Integer ids of uids, with a mask leaving out edges to nodes outside the snapshot
+    sorted_uids, order = ids
+    if not len(sorted_uids):
+        return np.zeros(len(uids), dtype=np.int32), np.zeros(len(uids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_uids, uids), len(sorted_uids) - 1)
+    return order[pos], sorted_uids[pos] == uids
+
+
+#################################################################
+#   Analytics
+
+def degree_distribution(degrees):
+    """counts[d] = number of nodes with degree d."""
+    return np.bincount(degrees)
+
+
+def pagerank(graph, damping=0.85, tol=1e-10, max_iter=100):
+    """PageRank of a square CSR graph by power iteration. The rank of nodes without
+    out edges is spread evenly over every node."""
+    n = graph.n_rows
+    if n == 0:
+        return np.zeros(0)
+    out_degree = graph.out_degree()
+    sources = graph.rows()
+    dangling = out_degree == 0
+    safe_degree = np.where(dangling, 1, out_degree)
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        contrib = (rank / safe_degree)[sources]
+        new_rank = np.bincount(graph.indices, weights=contrib, minlength=n)
+        new_rank = damping * (new_rank + rank[dangling].sum() / n) + (1 - damping) / n
+        delta = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if delta < tol:
+            break
+    return rank
+
+
+def tour_popularity(snapshot):
+    """Distinct users linked to every tour, through the user's tours or the tour's participants."""
+    n_users = len(snapshot.user_uids)
+    pairs = np.concatenate([
+        snapshot.tours.indices.astype(np.int64) * n_users + snapshot.tours.rows(),
+        snapshot.participants.rows().astype(np.int64) * n_users + snapshot.participants.indices,
+    ])
+    tours = np.unique(pairs) // max(n_users, 1)
+    return np.bincount(tours, minlength=len(snapshot.tour_uids))
+
+
+def write_back(client, snapshot, ranks, popularity, chunk_size=1000, workers=4):
+    """Stores pagerank on the users and popularity on the tours."""
+    users = ({'uid': uid, 'pagerank': float(rank)} for uid, rank in zip(snapshot.user_uids, ranks))
+    tours = ({'uid': uid, 'popularity': int(count)} for uid, count in zip(snapshot.tour_uids, popularity))
+    return (modelDgraph.mutate_chunks(client, users, chunk_size, workers),
+            modelDgraph.mutate_chunks(client, tours, chunk_size, workers))
+
+
+def _summary(name, degrees):
+    if not len(degrees):
+        return f"{name}: no nodes"
+    return (f"{name}: mean {degrees.mean():.2f}, max {degrees.max()}, "
+            f"p50 {np.percentile(degrees, 50):.0f}, p99 {np.percentile(degrees, 99):.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline graph analytics over a snapshot of Dgraph")
+    parser.add_argument("--top", type=int, default=10, help="users / tours to print")
+    parser.add_argument("--no-write", action="store_true", help="don't store pagerank / popularity back in Dgraph")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--degrees", help="JSON file of the degree distributions, {name: [nodes with degree 0, 1, ...]}")
+    args = parser.parse_args()
+
+    client_stub = pydgraph.DgraphClientStub(os.getenv('DGRAPH_URI', 'localhost:9080'))
+    client = pydgraph.DgraphClient(client_stub)
+
+    start = time.perf_counter()
+    snapshot = Snapshot.from_dgraph(client)
+    print(f"Exported {len(snapshot.user_uids)} users, {len(snapshot.tour_uids)} tours in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    degrees = {
+        "friends out-degree": snapshot.friends.out_degree(),
+        "friends in-degree": snapshot.friends.in_degree(),
+        "tours per user": snapshot.tours.out_degree(),
+        "participants per tour": snapshot.participants.out_degree(),
+        "similar tours in-degree": snapshot.similar_tours.in_degree(),
+    }
+    for name, degree in degrees.items():
+        print(_summary(name, degree))
+    if args.degrees:
+        with open(args.degrees, "w") as fd:
+            json.dump({name: degree_distribution(degree).tolist() for name, degree in degrees.items()}, fd)
+        print(f"Degree distributions written to {args.degrees}")
+    ranks = pagerank(snapshot.friends)
+    popularity = tour_popularity(snapshot)
+    print(f"Computed analytics in {time.perf_counter() - start:.2f}s")
+
+    for i in np.argsort(-ranks)[:args.top]:
+        print(f"  user {snapshot.user_uids[i]} pagerank {ranks[i]:.6f}")
+    for i in np.argsort(-popularity, kind='stable')[:args.top]:
+        print(f"  tour {snapshot.tour_uids[i]} popularity {popularity[i]}")
+
+    if not args.no_write:
+        start = time.perf_counter()
+        users, tours = write_back(client, snapshot, ranks, popularity, args.chunk_size, args.workers)
+        print(f"Wrote pagerank of {users} users, popularity of {tours} tours in {time.perf_counter() - start:.1f}s")
+    client_stub.close()
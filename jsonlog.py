@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import atexit
+import logging
+import os
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import orjson
+
+from metrics import request_log
+
+# Application log and request log (one JSON line per API call / backend query, empty
+# to disable it), both rotated past LOG_MAX_BYTES keeping LOG_BACKUPS old files
+LOG_FILE = os.getenv('LOG_FILE', 'tours.log')
+REQUEST_LOG_FILE = os.getenv('REQUEST_LOG_FILE', 'requests.jsonl')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '5'))
+
+_listener = None
+_handler = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message and the fields of the
+    'request' extra, if any."""
+
+    def format(self, record):
+        line = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request = getattr(record, 'request', None)
+        if request:
+            line.update(request)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exc'] = record.exc_text
+        return orjson.dumps(line, default=str).decode()
+
+
+class _RecordQueueHandler(QueueHandler):
+    """Enqueues the record as it is: the queue never leaves the process, so formatting
+    (and copying) the record is left to the writer thread."""
+
+    def prepare(self, record):
+        return record
+
+
+def _file_handler(path, max_bytes, backups):
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def setup_logging(log_file=LOG_FILE, request_log_file=REQUEST_LOG_FILE, level=None,
+                  max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    """Routes the root logger through a queue to a background thread writing JSON lines:
+    the request records to request_log_file and everything else to log_file. Logging
+    then costs the caller a record and a queue put, never a disk write.
+    level sets the root level (None leaves it). Returns the QueueListener, stopped (and
+    flushed) by stop_logging or at exit; calling it again returns the running one."""
+    global _listener, _handler
+    if _listener is not None:
+        return _listener
+    records = queue.SimpleQueue()
+    handlers = []
+    if log_file:
+        handler = _file_handler(log_file, max_bytes, backups)
+        handler.addFilter(lambda record: record.name != request_log.name)
+        handlers.append(handler)
+    if request_log_file:
+        handler = _file_handler(request_log_file, max_bytes, backups)
+        handler.addFilter(logging.Filter(request_log.name))
+        handlers.append(handler)
+        request_log.setLevel(logging.INFO)
+    else:
+        request_log.setLevel(logging.WARNING)
+    root = logging.getLogger()
+    if level is not None:
+        root.setLevel(level)
+    _handler = _RecordQueueHandler(records)
+    root.addHandler(_handler)
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Writes the queued records and stops the writer thread."""
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _listener = _handler = None
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# (latitude, longitude) of the tour locations generated by Random_Tour_csv.ipynb
+CITY_COORDINATES = {
+    "Paris": (48.8566, 2.3522),
+    "New York": (40.7128, -74.0060),
+    "Tokyo": (35.6762, 139.6503),
+    "Sydney": (-33.8688, 151.2093),
+    "Rome": (41.9028, 12.4964),
+    "London": (51.5074, -0.1278),
+    "Barcelona": (41.3874, 2.1686),
+    "Dubai": (25.2048, 55.2708),
+    "Cancun": (21.1619, -86.8515),
+    "Amsterdam": (52.3676, 4.9041),
+    "Maldives": (3.2028, 73.2207),
+    "Singapore": (1.3521, 103.8198),
+    "Los Angeles": (34.0522, -118.2437),
+    "Rio de Janeiro": (-22.9068, -43.1729),
+    "Vancouver": (49.2827, -123.1207),
+    "Istanbul": (41.0082, 28.9784),
+    "Bangkok": (13.7563, 100.5018),
+    "Buenos Aires": (-34.6037, -58.3816),
+    "Florence": (43.7696, 11.2558),
+    "Venice": (45.4408, 12.3155),
+    "Santorini": (36.3932, 25.4615),
+    "Kyoto": (35.0116, 135.7681),
+    "Bali": (-8.3405, 115.0920),
+    "Prague": (50.0755, 14.4378),
+    "Hawaii": (19.8968, -155.5828),
+    "Maui": (20.7984, -156.3319),
+    "Hong Kong": (22.3193, 114.1694),
+    "Las Vegas": (36.1699, -115.1398),
+    "Orlando": (28.5384, -81.3789),
+    "Mexico City": (19.4326, -99.1332),
+    "Marrakech": (31.6295, -7.9811),
+    "Cairo": (30.0444, 31.2357),
+    "Edinburgh": (55.9533, -3.1883),
+    "Athens": (37.9838, 23.7275),
+    "San Francisco": (37.7749, -122.4194),
+    "Niagara Falls": (43.0962, -79.0377),
+    "Grand Canyon": (36.1069, -112.1129),
+    "Stockholm": (59.3293, 18.0686),
+    "Berlin": (52.5200, 13.4050),
+    "Vienna": (48.2082, 16.3738),
+    "Seoul": (37.5665, 126.9780),
+    "Tulum": (20.2114, -87.4654),
+    "Caribe": (18.2208, -66.5901),
+    "Petra": (30.3285, 35.4444),
+    "Bora Bora": (-16.5004, -151.7415),
+    "Machu Picchu": (-13.1631, -72.5450),
+}
+
+_BY_NAME = {name.lower(): coordinates for name, coordinates in CITY_COORDINATES.items()}
+
+
+def city_coordinates(city):
+    """(latitude, longitude) of a known city (case insensitive), None otherwise."""
+    return _BY_NAME.get(city.strip().lower())
+
+
+def geo_point(latitude, longitude):
+    # GeoJSON orders coordinates as [longitude, latitude]
+    return {'type': 'Point', 'coordinates': [longitude, latitude]}
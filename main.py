@@ -4,103 +4,49 @@
 #--------------------------------------------------------------------------------------
 
 
-import datetime
-import pandas as pd
+import atexit
 import logging
 import os
-from cassandra.cluster import Cluster
 
+import jsonlog
+import metrics
 import modelCasandra
 
-# Set logger
+# Set logger: JSON lines written to tours.log (and the request log) by a background thread
 log = logging.getLogger()
-log.setLevel('INFO')
-handler = logging.FileHandler('tours.log')
-handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
-log.addHandler(handler)
+jsonlog.setup_logging(level='INFO')
 
 # Read env vars releated to Cassandra App
 CLUSTER_IPS = os.getenv('CASSANDRA_CLUSTER_IPS', 'localhost')
 KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'tours')
 REPLICATION_FACTOR = os.getenv('CASSANDRA_REPLICATION_FACTOR', '1')
-
-def insert_data_cassandra(session):
+LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC')
+PROTOCOL_VERSION = int(os.getenv('CASSANDRA_PROTOCOL_VERSION', '0')) or None
+# Requests in flight and statements per unlogged batch while loading
+CASSANDRA_LOAD_CONCURRENCY = int(os.getenv('CASSANDRA_LOAD_CONCURRENCY', '64'))
+CASSANDRA_BATCH_SIZE = int(os.getenv('CASSANDRA_BATCH_SIZE', '20'))
+# Rows per page of the history and duration listings
+CASSANDRA_PAGE_SIZE = int(os.getenv('CASSANDRA_PAGE_SIZE', '100'))
+
+def insert_data_cassandra(repo, path='tours_users_df.csv', rows=None):
+    # rows are csvsources.read_history records, read from path when not given.
+    # Returns True when every request succeeded
     log.info("Loading data from CSV file")
     try:
-        df = pd.read_csv('tours_users_df.csv')
-        
-        # Convert date columns to datetime objects
-        df["start_date"] = pd.to_datetime(df["start_date"])
-        df["end_date"] = pd.to_datetime(df["end_date"])
-
-        insert_users_info = session.prepare("""
-            INSERT INTO users 
-            (username, age, state, real_name, email)
-            VALUES (?, ?, ?, ?, ?)
-        """)
-        
-        for _, row in df.iterrows():
-            # Insert into users_history
-            session.execute(insert_users_info, (
-                row['username'],
-                int(row['age']),
-                row['state'],
-                row['real_name'],
-                row['email']
-            ))
-            
-        ################################
-        
-        insert_users_history = session.prepare("""
-            INSERT INTO users_history 
-            (tour_name, location, duration_days, price_per_person, start_date, 
-             max_participants, end_date, username, age, state, real_name, email)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """)
-        
-        for _, row in df.iterrows():
-            # Insert into users_history
-            session.execute(insert_users_history, (
-                row['tour_name'],
-                row['location'],
-                int(row['duration_days']),
-                float(row['price_per_person']),
-                row['start_date'],  # Now a datetime object
-                int(row['max_participants']),
-                row['end_date'],    # Now a datetime object
-                row['username'],
-                int(row['age']),
-                row['state'],
-                row['real_name'],
-                row['email']
-            ))
-
-        ################################
-
-        insert_tours_duration = session.prepare("""
-            INSERT INTO tours_duration 
-            (tour_name, location, duration_days, price_per_person, start_date, 
-            max_participants, end_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """)
-        for _, row in df.iterrows():
-            # Insert into tours_duration
-            session.execute(insert_tours_duration, (
-                row['tour_name'],
-                row['location'],
-                int(row['duration_days']),
-                float(row['price_per_person']),
-                row['start_date'],
-                int(row['max_participants']),
-                row['end_date']
-            ))
-            
+        rows = csvsources.read_history(path) if rows is None else rows
+        _, requests, errors = modelCasandra.load_data(repo, rows, concurrency=CASSANDRA_LOAD_CONCURRENCY, batch_size=CASSANDRA_BATCH_SIZE)
+        if errors:
+            log.error(f"Data partially loaded: {errors} of {requests} requests failed")
+            print(f"Data partially loaded: {errors} of {requests} requests failed")
+            return False
         log.info("Data loaded successfully")
         print("Data loaded successfully!")
-        
+        return True
+
     except Exception as e:
         log.error(f"Error loading data: {str(e)}")
         print(f"Error loading data: {str(e)}")
+        return False
 
 #--------------------------------------------------------------------------------------
 
@@ -109,99 +55,158 @@ def insert_data_cassandra(session):
 #--------------------------------------------------------------------------------------
 #!/usr/bin/env python3
 import argparse
-import requests
-import csv
-from datetime import datetime
+import json
+import uuid
+
+import apiclient
+import csvsources
 
 
 # Read env vars related to API connection
 MONGO_BASE_URL = "http://localhost:8000"
 TOURS_API_URL = os.getenv("TOURS_API_URL", MONGO_BASE_URL)
+# Rows per bulk request and documents per server-side insert_many
+MONGO_BULK_BATCH_SIZE = int(os.getenv("MONGO_BULK_BATCH_SIZE", "5000"))
+MONGO_BULK_CHUNK_SIZE = int(os.getenv("MONGO_BULK_CHUNK_SIZE", "1000"))
+MONGO_PAGE_SIZE = int(os.getenv("MONGO_PAGE_SIZE", "20"))
+# Bulk requests in flight at once while loading
+MONGO_BULK_WORKERS = int(os.getenv("MONGO_BULK_WORKERS", "4"))
 
 def print_objects(o):
     for k in o.keys():
         print(f"{k}: {o[k]}")
     print("="*50)
 
-def list_tours(start_date_From: str=None, start_date_To: str=None):
+def print_stream(endpoint, params):
+    # The whole result as NDJSON, printed line by line as it arrives
+    with apiclient.get(endpoint, params=dict(params, stream=1), stream=True) as response:
+        if not response.ok:
+            print(f"Error: {response}")
+            return
+        for line in response.iter_lines():
+            if line:
+                print_objects(json.loads(line))
+
+def print_pages(endpoint, params, page_size=MONGO_PAGE_SIZE):
+    # Follows the API continuation tokens (X-Next-Token), one page at a time.
+    # page_size <= 0 streams everything instead
+    if page_size <= 0:
+        print_stream(endpoint, params)
+        return
+    params = dict(params, limit=page_size)
+    while True:
+        response = apiclient.get(endpoint, params=params)
+        if not response.ok:
+            print(f"Error: {response}")
+            return
+        for obj in response.json():
+            print_objects(obj)
+        next_token = response.headers.get("X-Next-Token")
+        if not next_token:
+            return
+        if input("Next page y/n: ").lower() not in ("y", "yes"):
+            return
+        params["after"] = next_token
+
+def list_tours(start_date_From: str=None, start_date_To: str=None, min_price: float=None, max_price: float=None, location: str=None, sort: str=None, page_size: int=MONGO_PAGE_SIZE):
+    # Every given filter is applied by the API in a single query
     suffix = "/tours/T"
     endpoint = TOURS_API_URL + suffix
     params = {
         "start_date_From": start_date_From,
-        "start_date_To": start_date_To
+        "start_date_To": start_date_To,
+        "min_price": min_price,
+        "max_price": max_price,
+        "location": location,
+        "sort": sort,
     }
-    response = requests.get(endpoint, params=params)
-    if response.ok:
-        json_resp = response.json()
-        for tour in json_resp:
-            print_objects(tour)
-    else:
-        print(f"Error: {response}")
-def insert_data_mongo():
-    with open("./tours_data.csv") as fd:
-        tours_csv = csv.DictReader(fd)
-        for tour in tours_csv:
-            tour["start_date"] = datetime.strptime(tour["start_date"], "%Y-%m-%d %H:%M:%S.%f").isoformat()
-            tour["end_date"] = datetime.strptime(tour["end_date"], "%Y-%m-%d %H:%M:%S.%f").isoformat()
-            x = requests.post(MONGO_BASE_URL+"/tours/T", json=tour)
-            if not x.ok:
-                print(f"Failed to post book {x} - {tour}")
-    
-    with open("./users_data.csv") as fd:
-        users_csv = csv.DictReader(fd)
-        for user in users_csv:
-            x = requests.post(MONGO_BASE_URL+"/users/U", json=user)
-            if not x.ok:
-                print(f"Failed to post book {x} - {user}")
-
-def user_info_mongo(limit: int=0, skip: int=0):
+    print_pages(endpoint, params, page_size)
+
+def mongo_tour(tour):
+    # JSON body of a csvsources tour record
+    return dict(tour, start_date=tour["start_date"].isoformat(), end_date=tour["end_date"].isoformat())
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def with_id(documents):
+    # Ids are set here so a retried bulk request can't insert a document twice.
+    # Copies, the records may be shared with other loaders
+    for doc in documents:
+        yield doc if "_id" in doc else {"_id": str(uuid.uuid4()), **doc}
+
+def post_bulk(suffix, documents, chunk_size=MONGO_BULK_CHUNK_SIZE):
+    # Sent as NDJSON, the API validates and inserts it chunk_size documents at a time.
+    # The body is built upfront so the request can be retried. Returns (inserted, failed)
+    body = b"".join(json.dumps(doc).encode() + b"\n" for doc in documents)
+    response = apiclient.post(MONGO_BASE_URL + suffix, data=body, params={"chunk_size": chunk_size},
+                              headers={"Content-Type": "application/x-ndjson"})
+    if not response.ok:
+        print(f"Failed to post {suffix} batch {response}")
+        return 0, len(documents)
+    result = response.json()
+    failed = 0
+    for error in result["errors"]:
+        if error.get("code") == 11000:
+            # Already inserted by an earlier attempt of this request
+            continue
+        failed += 1
+        print(f"Failed to post {documents[error['index']]} - {error['error']}")
+    return result["inserted"], failed
+
+def load_bulk(suffix, documents, batch_size=MONGO_BULK_BATCH_SIZE, chunk_size=MONGO_BULK_CHUNK_SIZE, workers=MONGO_BULK_WORKERS):
+    # Returns (inserted, failed) documents
+    batches = batched(with_id(documents), batch_size)
+    inserted = failed = 0
+    for batch_inserted, batch_failed in apiclient.run_bounded(lambda batch: post_bulk(suffix, batch, chunk_size), batches, workers):
+        inserted += batch_inserted
+        failed += batch_failed
+    return inserted, failed
+
+def insert_data_mongo(batch_size: int=MONGO_BULK_BATCH_SIZE, chunk_size: int=MONGO_BULK_CHUNK_SIZE, workers: int=MONGO_BULK_WORKERS, tours=None, users=None):
+    # tours / users are csvsources records, read from the CSVs when not given.
+    # Returns the number of documents that failed
+    tours = csvsources.read_tours() if tours is None else tours
+    inserted, tours_failed = load_bulk("/tours/T/bulk", map(mongo_tour, tours), batch_size, chunk_size, workers)
+    print(f"Inserted {inserted} tours, {tours_failed} failed")
+
+    users = csvsources.read_users() if users is None else users
+    inserted, users_failed = load_bulk("/users/U/bulk", users, batch_size, chunk_size, workers)
+    print(f"Inserted {inserted} users, {users_failed} failed")
+    return tours_failed + users_failed
+
+def user_info_mongo(page_size: int=MONGO_PAGE_SIZE):
     suffix = "/users/U"
     endpoint = MONGO_BASE_URL + suffix
-    params = {
-        "limit": limit,
-        "skip": skip,
-    }
-    response = requests.get(endpoint, params=params)
-    if response.ok:
-        json_resp = response.json()
-        for user in json_resp:
-            print_objects(user)
-    else:
-        print(f"Error: {response}")
+    print_pages(endpoint, {}, page_size)
 
-def get_tours_by_price_range(min_price: float=0, max_price: float=10000):
-    suffix = "/tours/T"
-    endpoint = TOURS_API_URL + suffix
-    params = {
-        "min_price": min_price,
-        "max_price": max_price
-    }
-    response = requests.get(endpoint, params=params)
-    if response.ok:
-        json_resp = response.json()
-        for tour in json_resp:
-            print_objects(tour)
-    else:
-        print(f"Error: {response}")
+def get_tours_by_price_range(min_price: float=0, max_price: float=10000, page_size: int=MONGO_PAGE_SIZE):
+    list_tours(min_price=min_price, max_price=max_price, sort="price_per_person", page_size=page_size)
 
-def get_tours_by_location(location: str=None):
-    suffix = "/tours/T"
-    endpoint = TOURS_API_URL + suffix
-    params = {
-        "location": location
-    }
-    response = requests.get(endpoint, params=params)
-    if response.ok:
-        json_resp = response.json()
-        for tour in json_resp:
-            print_objects(tour)
-    else:
+def get_tours_by_location(location: str=None, page_size: int=MONGO_PAGE_SIZE):
+    # Prefix search on the API's in-memory index ('barc' finds Barcelona)
+    endpoint = TOURS_API_URL + "/tours/T/search"
+    response = apiclient.get(endpoint, params={"q": location, "limit": page_size})
+    if not response.ok:
         print(f"Error: {response}")
+        return
+    tours = response.json()
+    if not tours:
+        print(f"No tours found for {location}")
+    for tour in tours:
+        print_objects(tour)
 
 def Tours_general_info():
     suffix = "/tours/T/general_info"
     endpoint = TOURS_API_URL + suffix
-    response = requests.get(endpoint)
+    response = apiclient.get(endpoint)
     if response.ok:
         json_resp = response.json()
         for tour in json_resp:
@@ -221,11 +226,17 @@ def Tours_general_info():
 import os
 import pydgraph
 import modelDgraph
+import pipeline
+from locations import city_coordinates
 #import set_schema, insert_data_dgraph, get_similar_tours, get_friends_tours, get_follows
 #from modelDgraph import set_schema, insert_data_dgraph, get_similar_tours, get_friends_tours, get_follows
 
 # Dgraph connection details
 DGRAPH_URI = os.getenv('DGRAPH_URI', 'localhost:9080')
+# Objects per transaction and concurrent transactions while loading
+DGRAPH_LOAD_CHUNK_SIZE = int(os.getenv('DGRAPH_LOAD_CHUNK_SIZE', '1000'))
+DGRAPH_LOAD_WORKERS = int(os.getenv('DGRAPH_LOAD_WORKERS', '4'))
+DGRAPH_LOAD_RETRIES = int(os.getenv('DGRAPH_LOAD_RETRIES', '5'))
 
 def create_client_stub():
     return pydgraph.DgraphClientStub(DGRAPH_URI)
@@ -236,6 +247,79 @@ def create_client(client_stub):
 def close_client_stub(client_stub):
     client_stub.close()
 
+def tours_near_dgraph(client):
+    place = input("Enter a city or 'latitude,longitude': ")
+    coordinates = city_coordinates(place)
+    if coordinates is None:
+        try:
+            coordinates = tuple(float(value) for value in place.split(','))
+        except ValueError:
+            coordinates = ()
+        if len(coordinates) != 2:
+            print(f"Unknown location {place}")
+            return
+    radius = float(input("Radius in km: "))
+    min_price = input("Minimum price per person (empty for any): ")
+    max_price = input("Maximum price per person (empty for any): ")
+    start_from = input("Starting from (example: '2025-09-04', empty for any): ")
+    tours = modelDgraph.tours_near(client, *coordinates, radius,
+                                   min_price=float(min_price) if min_price else None,
+                                   max_price=float(max_price) if max_price else None,
+                                   start_from=start_from or None)
+    if not tours:
+        print(f"No tours found within {radius} km of {place}")
+        return
+    print(f"Tours near {place}: {json.dumps(tours, indent=2)}")
+
+def insert_data(repo, client):
+    # Each CSV is parsed once and streamed to the three stores, which load concurrently.
+    # Returns the names of the sources and stores that failed (pipeline.run doesn't raise)
+    def mongo(tours, users):
+        failed = insert_data_mongo(tours=tours, users=users)
+        if failed:
+            raise RuntimeError(f"{failed} documents failed")
+
+    def cassandra(history):
+        if not insert_data_cassandra(repo, rows=history):
+            raise RuntimeError("load failed")
+
+    stats = pipeline.run(
+        sources={
+            "tours": csvsources.read_tours(),
+            "users": csvsources.read_users(),
+            "history": csvsources.read_history('tours_users_df.csv'),
+        },
+        stages={
+            "mongo": (mongo, ["tours", "users"]),
+            "cassandra": (cassandra, ["history"]),
+            "dgraph": (lambda tours, users: modelDgraph.load_data(client, DGRAPH_LOAD_CHUNK_SIZE, DGRAPH_LOAD_WORKERS,
+                                                                  DGRAPH_LOAD_RETRIES, tours=tours, users=users), ["tours", "users"]),
+        },
+    )
+    return [name for name, stage_stats in stats.items() if stage_stats.error is not None]
+
+def counts_only():
+    return input("Counts only y/n: ").lower() in ("y", "yes")
+
+def friend_tours_dgraph(client, username):
+    # One page of friends at a time, following the uid cursor
+    if counts_only():
+        modelDgraph.friend_tours(client, username, count_only=True)
+        return
+    after = modelDgraph.friend_tours(client, username)
+    while after and input("Next page y/n: ").lower() in ("y", "yes"):
+        after = modelDgraph.friend_tours(client, username, after=after)
+
+def follows_dgraph(client, username):
+    if counts_only():
+        modelDgraph.follows(client, username, count_only=True)
+        return
+    friends_after, followers_after = modelDgraph.follows(client, username)
+    while (friends_after or followers_after) and input("Next page y/n: ").lower() in ("y", "yes"):
+        friends_after, followers_after = modelDgraph.follows(
+            client, username, friends_after=friends_after, followers_after=followers_after,
+            friends=bool(friends_after), followers=bool(followers_after))
+
 #--------------------------------------------------------------------------------------
 def set_username():
     username = input('**** Username to use app: ')
@@ -267,6 +351,8 @@ def print_tours_menu():
         6: "Similar tours to (needs a name)",           #Dgraph
         7: "Contracted by friends",                     #Dgraph
         8: "Followers and Followings of friends",       #Dgraph
+        9: "Recommended from friends",                  #Dgraph
+        10: "Near a location",                          #Dgraph
     }
     for key in thm_options.keys():
         print('    ', key, '--', thm_options[key])
@@ -275,13 +361,14 @@ def print_tours_menu():
 def main():
     
     log.info("Connecting to Cluster")
-    cluster = Cluster(CLUSTER_IPS.split(','))
+    cluster = modelCasandra.create_cluster(CLUSTER_IPS.split(','), LOCAL_DC, PROTOCOL_VERSION)
     session = cluster.connect()
 
     modelCasandra.create_keyspace(session, KEYSPACE, REPLICATION_FACTOR)
     session.set_keyspace(KEYSPACE)
 
     modelCasandra.create_schema(session)
+    repo = modelCasandra.ToursRepository(session)
 
     
     #Dgraph
@@ -294,8 +381,21 @@ def main():
     modelDgraph.set_schema(client)
 
     parser = argparse.ArgumentParser()
+    parser.add_argument('--migrate-tours-duration', action='store_true',
+                        help='copy the unbucketed Cassandra tours_duration table into tours_by_duration and exit')
+    parser.add_argument('--metrics', action='store_true',
+                        help='print the latency, errors, rows and bytes of the backend calls on exit')
     args = parser.parse_args()
 
+    if args.metrics:
+        atexit.register(lambda: print(metrics.registry.summary()))
+
+    if args.migrate_tours_duration:
+        modelCasandra.migrate_tours_duration(repo, concurrency=CASSANDRA_LOAD_CONCURRENCY)
+        cluster.shutdown()
+        close_client_stub(client_stub)
+        return
+
     username = set_username()
 
     
@@ -305,29 +405,24 @@ def main():
         option = int(input('Enter your choice: '))
         if option == 0:
             try:
-                insert_data_mongo()
-                insert_data_cassandra(session)
-                modelDgraph.load_data(client)  # Dgraph
-                print("Data inserted successfully!")
+                failed = insert_data(repo, client)                              #Mongo, Cassandra, Dgraph
+                if failed:
+                    print(f"Error inserting data: {', '.join(failed)} failed, see above")
+                else:
+                    print("Data inserted successfully!")
             except Exception as e:
                 print(f"Error inserting data: {e}")  # Dgraph
         elif option == 1:
-            opt_limit="n"
-            opt_limit = input("limit y/n: ").lower()
-            limit=0
-            if opt_limit == "y" or opt_limit =="yes":
-                limit = int(input("limit value: "))
-
-            opt_skip="n"
-            opt_skip = input("skip y/n: ").lower()
-            skip=0
-            if opt_skip == "y" or opt_skip =="yes":
-                skip = int(input("skip value: "))
-            user_info_mongo(limit, skip)                                                 #Mongo
+            opt_page="n"
+            opt_page = input("page size y/n: ").lower()
+            page_size=MONGO_PAGE_SIZE
+            if opt_page == "y" or opt_page =="yes":
+                page_size = int(input("page size value (0 streams all users): "))
+            user_info_mongo(page_size)                                                   #Mongo
         elif option == 2:
-            modelCasandra.get_user_info(session, username)                   #Cassandra
+            modelCasandra.get_user_info(repo, username)                   #Cassandra
         elif option == 3:
-            modelCasandra.get_user_history(session, username)                   #Cassandra
+            modelCasandra.get_user_history(repo, username, CASSANDRA_PAGE_SIZE)                 #Cassandra
         elif option == 4:
 
             print_tours_menu()
@@ -336,7 +431,7 @@ def main():
                 Tours_general_info()                             #Mongo
 
             if tour_option == 1:
-                list_tours()                             #Mongo
+                list_tours(page_size=0)                  #Mongo
             #
             if tour_option == 2:
                 print("Enter the start Date (exaple: '2025-09-04 09:55:17.905467')")
@@ -347,7 +442,7 @@ def main():
             if tour_option == 3:
                 print("Enter the wished duration in days")
                 duration= input('Duration: ')
-                modelCasandra.list_tours_duration(session, duration)            #Cassandra
+                modelCasandra.list_tours_duration(repo, duration, CASSANDRA_PAGE_SIZE)          #Cassandra
             #
             if tour_option == 4:
                 min_price = float(input("Enter minimum price per person: "))
@@ -356,7 +451,7 @@ def main():
             #
             if tour_option == 5:
                 print('Some available locations: "Paris", "New York", "Tokyo", "Sydney", "Rome", "London", "Barcelona"...')
-                location = input("Enter location name: ").lower()
+                location = input("Enter location or tour name (the beginning is enough): ").lower()
                 get_tours_by_location(location)                                 #Mongo
             #
             if tour_option == 6:
@@ -364,10 +459,17 @@ def main():
                 modelDgraph.similar_tours(client, tour_name)                            #Dgraph
             
             elif tour_option == 7:
-                modelDgraph.friend_tours(client, username)       
+                friend_tours_dgraph(client, username)                                   #Dgraph
                 
             if tour_option == 8:
-                modelDgraph.follows(client, username)                                   #Dgraph
+                follows_dgraph(client, username)                                        #Dgraph
+
+            if tour_option == 9:
+                depth = input("Include friends of friends y/n: ").lower() in ("y", "yes")
+                modelDgraph.recommend_tours(client, username, depth=2 if depth else 1)  #Dgraph
+
+            if tour_option == 10:
+                tours_near_dgraph(client)                                               #Dgraph
 
         elif option == 5:
             username = set_username()
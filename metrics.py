@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets, plus a last +Inf bucket
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every observed call is also a record of this logger, written once jsonlog.setup_logging enables it
+request_log = logging.getLogger('request_log')
+
+
+class OperationStats:
+    """Calls, errors, rows, bytes and a latency histogram of one (store, operation)."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds, rows, nbytes, error):
+        self.count += 1
+        self.errors += bool(error)
+        self.rows += rows
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def quantile(self, q):
+        """Latency under which a fraction q of the calls fall, interpolated inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 6),
+            'mean_ms': round(self.seconds / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.50) * 1000, 3),
+            'p95_ms': round(self.quantile(0.95) * 1000, 3),
+            'p99_ms': round(self.quantile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+            'buckets': dict(zip([*map(str, LATENCY_BUCKETS), '+Inf'], self.buckets)),
+        }
+
+
+class Call:
+    """Handed out by Registry.timed, the caller fills in what the call returned."""
+    __slots__ = ('rows', 'bytes', 'error')
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.error = False
+
+
+class Registry:
+    """Per process metrics of the backend calls, keyed by (store, operation)."""
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def observe(self, store, operation, seconds, rows=0, nbytes=0, error=False, params=None):
+        """Records one call; params (the arguments of the call) only go to the request log."""
+        with self._lock:
+            stats = self._operations.get((store, operation))
+            if stats is None:
+                stats = self._operations[(store, operation)] = OperationStats()
+            stats.observe(seconds, rows, nbytes, error)
+        if request_log.isEnabledFor(logging.INFO):
+            request_log.info(operation, extra={'request': {
+                'store': store, 'operation': operation, 'ms': round(seconds * 1000, 3),
+                'rows': rows, 'bytes': nbytes, 'error': bool(error), 'params': params,
+            }})
+
+    @contextmanager
+    def timed(self, store, operation, params=None):
+        """Times the block as one call, counted as an error if it raises or sets call.error."""
+        call = Call()
+        start = time.perf_counter()
+        try:
+            yield call
+        except BaseException:
+            call.error = True
+            raise
+        finally:
+            self.observe(store, operation, time.perf_counter() - start, call.rows, call.bytes, call.error, params)
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def snapshot(self):
+        """{'stores': totals per store, 'operations': {store: {operation: stats}}}."""
+        with self._lock:
+            items = sorted(self._operations.items())
+            operations, stores = {}, {}
+            for (store, operation), stats in items:
+                operations.setdefault(store, {})[operation] = stats.to_dict()
+                total = stores.setdefault(store, {'count': 0, 'errors': 0, 'rows': 0, 'bytes': 0, 'seconds': 0.0})
+                total['count'] += stats.count
+                total['errors'] += stats.errors
+                total['rows'] += stats.rows
+                total['bytes'] += stats.bytes
+                total['seconds'] = round(total['seconds'] + stats.seconds, 6)
+        return {'stores': stores, 'operations': operations}
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            items = sorted(self._operations.items())
+            lines = []
+            for name, kind, help in (
+                    ('backend_call_seconds', 'histogram', 'Latency of the backend calls'),
+                    ('backend_call_errors_total', 'counter', 'Backend calls that failed'),
+                    ('backend_rows_total', 'counter', 'Rows returned or written by the backend calls'),
+                    ('backend_bytes_total', 'counter', 'Bytes transferred by the backend calls')):
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (store, operation), stats in items:
+                    labels = f'store="{store}",operation="{operation}"'
+                    if kind == 'histogram':
+                        cumulative = 0
+                        for bound, n in zip([*map(str, LATENCY_BUCKETS), '+Inf'], stats.buckets):
+                            cumulative += n
+                            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                        lines.append(f"{name}_sum{{{labels}}} {stats.seconds}")
+                        lines.append(f"{name}_count{{{labels}}} {stats.count}")
+                    else:
+                        value = {'backend_call_errors_total': stats.errors, 'backend_rows_total': stats.rows,
+                                 'backend_bytes_total': stats.bytes}[name]
+                        lines.append(f"{name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Table of the operations, the stores with the most time spent first."""
+        snapshot = self.snapshot()
+        if not snapshot['operations']:
+            return "No backend calls recorded"
+        lines = [f"{'store':10} {'operation':34} {'calls':>7} {'errors':>6} {'rows':>9} {'bytes':>11} "
+                 f"{'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'total s':>8}"]
+        for store in sorted(snapshot['stores'], key=lambda store: -snapshot['stores'][store]['seconds']):
+            for operation, stats in sorted(snapshot['operations'][store].items(), key=lambda item: -item[1]['seconds']):
+                lines.append(f"{store:10} {operation:34} {stats['count']:7} {stats['errors']:6} {stats['rows']:9} "
+                             f"{stats['bytes']:11} {stats['mean_ms']:8.2f} {stats['p50_ms']:8.2f} {stats['p95_ms']:8.2f} "
+                             f"{stats['p99_ms']:8.2f} {stats['seconds']:8.2f}")
+        return "\n".join(lines)
+
+
+registry = Registry()
+observe = registry.observe
+timed = registry.timed
@@ -1,6 +1,17 @@
 #!/usr/bin/env python3
+import heapq
 import logging
-from datetime import datetime
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.concurrent import execute_concurrent
+from cassandra.policies import DCAwareRoundRobinPolicy, TokenAwarePolicy
+from cassandra.query import BatchStatement, BatchType, SimpleStatement, tuple_factory
+
+import metrics
 
 # Set logger
 log = logging.getLogger()
@@ -41,24 +52,26 @@ CREATE_TABLE_USERS_HISTORY = """
     )
 """
 
+# Each duration is spread over DURATION_BUCKETS partitions (bucket derived from tour_id),
+# and tour_id keeps tours sharing name and start date apart
 CREATE_TABLE_TOURS_DAYS = """
-    CREATE TABLE IF NOT EXISTS tours_duration (
+    CREATE TABLE IF NOT EXISTS tours_by_duration (
+        duration_days INT,
+        bucket INT,
+        start_date TIMESTAMP,
+        tour_id UUID,
         tour_name TEXT,
         location TEXT,
-        duration_days INT,
         price_per_person FLOAT,
-        start_date TIMESTAMP,
         max_participants INT,
         end_date TIMESTAMP,
-        username TEXT,
-        age INT,
-        state TEXT,
-        real_name TEXT,
-        email TEXT,
-        PRIMARY KEY ((duration_days), tour_name)
+        PRIMARY KEY ((duration_days, bucket), start_date, tour_id)
     )
 """
 
+# Changing it requires reloading tours_by_duration
+DURATION_BUCKETS = 16
+
 ################################################################
 #   Q1
 SELECT_USER_INFO = """
@@ -75,11 +88,53 @@ SELECT_USER_HISTORY = """
     ORDER BY start_date DESC;
 """
 
-#   Q3
+#   Q3, run once per bucket; tour_id is selected last for the continuation token
 SELECT_TOURS_DURATION = """
-    SELECT tour_name, location, duration_days, price_per_person, start_date, end_date, max_participants
+    SELECT tour_name, location, duration_days, price_per_person, start_date, end_date, max_participants, tour_id
+    FROM tours_by_duration
+    WHERE duration_days = ? AND bucket = ?
+    LIMIT ?
+"""
+
+# Whole bucket, read by iter_tours_duration with driver paging
+SELECT_TOURS_DURATION_BUCKET = """
+    SELECT tour_name, location, duration_days, price_per_person, start_date, end_date, max_participants, tour_id
+    FROM tours_by_duration
+    WHERE duration_days = ? AND bucket = ?
+"""
+
+SELECT_TOURS_DURATION_AFTER = """
+    SELECT tour_name, location, duration_days, price_per_person, start_date, end_date, max_participants, tour_id
+    FROM tours_by_duration
+    WHERE duration_days = ? AND bucket = ? AND (start_date, tour_id) > (?, ?)
+    LIMIT ?
+"""
+
+# Unbucketed table of the previous schema, read by migrate_tours_duration
+SELECT_LEGACY_TOURS_DURATION = """
+    SELECT tour_name, location, duration_days, price_per_person, start_date, max_participants, end_date
     FROM tours_duration
-    WHERE duration_days = ?
+"""
+
+################################################################
+INSERT_USER = """
+    INSERT INTO users
+    (username, age, state, real_name, email)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+INSERT_USER_HISTORY = """
+    INSERT INTO users_history
+    (tour_name, location, duration_days, price_per_person, start_date,
+     max_participants, end_date, username, age, state, real_name, email)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_TOUR_DURATION = """
+    INSERT INTO tours_by_duration
+    (duration_days, bucket, start_date, tour_id, tour_name, location,
+    price_per_person, max_participants, end_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
 """
 
 #################################################################
@@ -94,38 +149,238 @@ def create_schema(session):
     session.execute(CREATE_TABLE_USERS_HISTORY)
     session.execute(CREATE_TABLE_TOURS_DAYS)
 
+
+def create_cluster(contact_points, local_dc=None, protocol_version=None):
+    """Cluster routing every request to a replica of its partition (token aware) in the
+    local datacenter, rows come back as plain tuples for ToursRepository."""
+    profile = ExecutionProfile(
+        load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=local_dc)),
+        row_factory=tuple_factory,
+    )
+    kwargs = {'protocol_version': protocol_version} if protocol_version else {}
+    return Cluster(contact_points, execution_profiles={EXEC_PROFILE_DEFAULT: profile}, **kwargs)
+
+#################################################################
+#   Repository
+
+class UserInfo(NamedTuple):
+    username: str
+    age: int
+    state: str
+    real_name: str
+    email: str
+
+
+class TourRecord(NamedTuple):
+    tour_name: str
+    location: str
+    duration_days: int
+    price_per_person: float
+    start_date: datetime
+    end_date: datetime
+    max_participants: int
+
+
+class DurationRow(NamedTuple):
+    # TourRecord plus the tour_id the Q3 merge and token need
+    tour_name: str
+    location: str
+    duration_days: int
+    price_per_person: float
+    start_date: datetime
+    end_date: datetime
+    max_participants: int
+    tour_id: uuid.UUID
+
+
+# Rows fetched per round trip by the paged reads
+DEFAULT_FETCH_SIZE = 100
+
+TOUR_ID_NAMESPACE = uuid.UUID('6f1c1e0a-5b7e-4d4a-9a7e-2d0c3b8f4e11')
+
+
+def tour_id(tour_name, location, duration_days, start_date):
+    """Deterministic id of a tour, reloading the same data overwrites instead of duplicating.
+    start_date is hashed as Cassandra stores it (UTC, milliseconds), so a tour read back
+    from a timestamp column gets the same id as the CSV row it was loaded from."""
+    if start_date.tzinfo is not None:
+        start_date = start_date.astimezone(timezone.utc).replace(tzinfo=None)
+    start_date = start_date.replace(microsecond=start_date.microsecond // 1000 * 1000)
+    return uuid.uuid5(TOUR_ID_NAMESPACE, f"{tour_name}|{location}|{duration_days}|{start_date.isoformat()}")
+
+
+def duration_bucket(tour_uuid, buckets=DURATION_BUCKETS):
+    return zlib.crc32(tour_uuid.bytes) % buckets
+
+
+def encode_paging_state(paging_state):
+    return paging_state.hex() if paging_state else None
+
+
+def decode_paging_state(token):
+    return bytes.fromhex(token) if token else None
+
+
+def encode_duration_cursor(row):
+    # (start_date, tour_id) of the last row returned, start_date in epoch milliseconds
+    millis = round((row.start_date - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return f"{millis}.{row.tour_id.hex}"
+
+
+def decode_duration_cursor(token):
+    millis, tour_uuid = token.split(".")
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), uuid.UUID(tour_uuid)
+
+
+class ToursRepository:
+    """Q1-Q3 and the inserts, prepared once against a session already set to the keyspace.
+    Q2 and Q3 come in three flavours: the whole result as a list, a generator fetching
+    fetch_size rows per round trip, and single pages with a resumable paging_state token.
+    Q3 reads every bucket of the duration in parallel and merges them by (start_date, tour_id),
+    its token is the position of the last row rather than a driver paging_state."""
+
+    def __init__(self, session):
+        self.session = session
+        self.select_user_info = session.prepare(SELECT_USER_INFO)
+        self.select_user_history = session.prepare(SELECT_USER_HISTORY)
+        self.select_tours_duration = session.prepare(SELECT_TOURS_DURATION)
+        self.select_tours_duration_after = session.prepare(SELECT_TOURS_DURATION_AFTER)
+        self.select_tours_duration_bucket = session.prepare(SELECT_TOURS_DURATION_BUCKET)
+        self.insert_user = session.prepare(INSERT_USER)
+        self.insert_user_history = session.prepare(INSERT_USER_HISTORY)
+        self.insert_tour_duration = session.prepare(INSERT_TOUR_DURATION)
+
+    #   Q1
+    def get_user_info(self, username) -> Optional[UserInfo]:
+        with metrics.timed('cassandra', 'user_info', {'username': username}) as call:
+            row = self.session.execute(self.select_user_info, [username]).one()
+            call.rows = int(row is not None)
+        return UserInfo._make(row) if row else None
+
+    def _iter(self, operation, prepared, values, fetch_size, record=TourRecord):
+        statement = prepared.bind(values)
+        statement.fetch_size = fetch_size
+        # Every page is a request (and a metrics call), the next one is fetched only once
+        # the current one is consumed
+        params = {'values': values, 'fetch_size': fetch_size}
+        with metrics.timed('cassandra', operation, params) as call:
+            result = self.session.execute(statement)
+            call.rows = len(result.current_rows)
+        while True:
+            for row in result.current_rows:
+                yield record._make(row)
+            if not result.has_more_pages:
+                return
+            with metrics.timed('cassandra', operation, params) as call:
+                result.fetch_next_page()
+                call.rows = len(result.current_rows)
+
+    def _page(self, operation, prepared, values, fetch_size, paging_state):
+        statement = prepared.bind(values)
+        statement.fetch_size = fetch_size
+        params = {'values': values, 'fetch_size': fetch_size, 'paging_state': paging_state}
+        with metrics.timed('cassandra', operation, params) as call:
+            result = self.session.execute(statement, paging_state=decode_paging_state(paging_state))
+            call.rows = len(result.current_rows)
+        return [TourRecord._make(row) for row in result.current_rows], encode_paging_state(result.paging_state)
+
+    #   Q2
+    def get_user_history(self, username) -> List[TourRecord]:
+        return list(self.iter_user_history(username))
+
+    def iter_user_history(self, username, fetch_size=DEFAULT_FETCH_SIZE) -> Iterator[TourRecord]:
+        return self._iter('user_history', self.select_user_history, [username], fetch_size)
+
+    def page_user_history(self, username, fetch_size=DEFAULT_FETCH_SIZE, paging_state=None) -> Tuple[List[TourRecord], Optional[str]]:
+        """One page of the history and the token of the next one (None on the last page)."""
+        return self._page('user_history', self.select_user_history, [username], fetch_size, paging_state)
+
+    #   Q3
+    def list_tours_duration(self, duration) -> List[TourRecord]:
+        return list(self.iter_tours_duration(duration))
+
+    def iter_tours_duration(self, duration, fetch_size=DEFAULT_FETCH_SIZE) -> Iterator[TourRecord]:
+        """The tours ordered by start date: one driver paged read per bucket, merged, so
+        every row is read once (page_tours_duration reads up to a page per bucket for each page)."""
+        duration = int(duration)
+        buckets = [self._iter('tours_duration', self.select_tours_duration_bucket, [duration, bucket], fetch_size, DurationRow)
+                   for bucket in range(DURATION_BUCKETS)]
+        for row in heapq.merge(*buckets, key=lambda row: (row.start_date, row.tour_id)):
+            yield TourRecord._make(row[:-1])
+
+    def page_tours_duration(self, duration, fetch_size=DEFAULT_FETCH_SIZE, paging_state=None) -> Tuple[List[TourRecord], Optional[str]]:
+        """One page of the tours ordered by start date and the token of the next one
+        (None on the last page). Each bucket returns at most fetch_size rows after the
+        token, so the first fetch_size rows of their merge are exact."""
+        duration = int(duration)
+        params = {'duration': duration, 'fetch_size': fetch_size, 'paging_state': paging_state}
+        with metrics.timed('cassandra', 'tours_duration', params) as call:
+            if paging_state:
+                start_date, last_id = decode_duration_cursor(paging_state)
+                futures = [self.session.execute_async(self.select_tours_duration_after,
+                                                      [duration, bucket, start_date, last_id, fetch_size + 1])
+                           for bucket in range(DURATION_BUCKETS)]
+            else:
+                futures = [self.session.execute_async(self.select_tours_duration, [duration, bucket, fetch_size + 1])
+                           for bucket in range(DURATION_BUCKETS)]
+            # Buckets come back sorted by (start_date, tour_id), the clustering order
+            buckets = [[DurationRow._make(row) for row in future.result()] for future in futures]
+            call.rows = sum(map(len, buckets))
+        rows = list(heapq.merge(*buckets, key=lambda row: (row.start_date, row.tour_id)))
+        next_token = encode_duration_cursor(rows[fetch_size - 1]) if len(rows) > fetch_size else None
+        return [TourRecord._make(row[:-1]) for row in rows[:fetch_size]], next_token
+
+#################################################################
+#   CLI
+
 #   Q1 
-def get_user_info(session, username):
+def get_user_info(repo, username):
     log.info(f"Retrieving {username} info")
     try:
-        prepared_stmt = session.prepare(SELECT_USER_INFO)
-        rows = session.execute(prepared_stmt, [username])
+        row = repo.get_user_info(username)
         
-        if not rows:
+        if not row:
             print(f"No info found for user {username}")
             return
         
         print(f"\nUser {username} info:")
         print("=" * 80)
-        for row in rows:
-            print(f"\nUsername: {row.username}")
-            print(f"Age: {row.age}")
-            print(f"State: {row.state}")
-            print(f"Name: {row.real_name}")
-            print(f"Email: {row.email}")
-            print("-" * 40)
+        print(f"\nUsername: {row.username}")
+        print(f"Age: {row.age}")
+        print(f"State: {row.state}")
+        print(f"Name: {row.real_name}")
+        print(f"Email: {row.email}")
+        print("-" * 40)
             
     except Exception as e:
         log.error(f"Error retrieving user info: {str(e)}")
         print(f"Error retrieving user info: {str(e)}")
 
+def print_tour(row):
+    print(f"\nTour: {row.tour_name}")
+    print(f"Location: {row.location}")
+    print(f"Duration: {row.duration_days} days")
+    print(f"Price: ${row.price_per_person:.2f}")
+    print(f"Start Date: {row.start_date}")
+    print(f"End Date: {row.end_date}")
+    print(f"Max Participants: {row.max_participants}")
+    print("-" * 40)
+
+
+def print_tour_pages(rows, paging_state, next_page):
+    # next_page(paging_state) -> (rows, paging_state) of the following page
+    while True:
+        for row in rows:
+            print_tour(row)
+        if not paging_state or input("Next page y/n: ").lower() not in ("y", "yes"):
+            return
+        rows, paging_state = next_page(paging_state)
+
 #   Q2
-def get_user_history(session, username):
+def get_user_history(repo, username, page_size=DEFAULT_FETCH_SIZE):
     log.info(f"Retrieving {username} previous tours history")
     try:
-
-        prepared_stmt = session.prepare(SELECT_USER_HISTORY)
-        rows = session.execute(prepared_stmt, [username])
+        rows, paging_state = repo.page_user_history(username, page_size)
         
         if not rows:
             print(f"No tours found for user {username}")
@@ -133,15 +388,7 @@ def get_user_history(session, username):
         
         print(f"\nTours history for user {username}:")
         print("=" * 80)
-        for row in rows:
-            print(f"\nTour: {row.tour_name}")
-            print(f"Location: {row.location}")
-            print(f"Duration: {row.duration_days} days")
-            print(f"Price: ${row.price_per_person:.2f}")
-            print(f"Start Date: {row.start_date}")
-            print(f"End Date: {row.end_date}")
-            print(f"Max Participants: {row.max_participants}")
-            print("-" * 40)
+        print_tour_pages(rows, paging_state, lambda state: repo.page_user_history(username, page_size, state))
             
     except Exception as e:
         log.error(f"Error retrieving user history: {str(e)}")
@@ -149,11 +396,10 @@ def get_user_history(session, username):
 
 
 #   Q3
-def list_tours_duration(session, duration):
+def list_tours_duration(repo, duration, page_size=DEFAULT_FETCH_SIZE):
     log.info(f"Retrieving tours with {duration} days duration")
     try:
-        prepared_stmt = session.prepare(SELECT_TOURS_DURATION)
-        rows = session.execute(prepared_stmt, [int(duration)])
+        rows, paging_state = repo.page_tours_duration(duration, page_size)
         
         if not rows:
             print(f"No tours found for {duration} days duration")
@@ -161,17 +407,123 @@ def list_tours_duration(session, duration):
         
         print(f"\nTours available:")
         print("=" * 80)
-        for row in rows:
-            print(f"\nTour: {row.tour_name}")
-            print(f"Location: {row.location}")
-            print(f"Duration: {row.duration_days} days")
-            print(f"Price: ${row.price_per_person:.2f}")
-            print(f"Start Date: {row.start_date}")
-            print(f"End Date: {row.end_date}")
-            print(f"Max Participants: {row.max_participants}")
-            print("-" * 40)
+        print_tour_pages(rows, paging_state, lambda state: repo.page_tours_duration(duration, page_size, state))
             
     except Exception as e:
         log.error(f"Error retrieving tours: {str(e)}")
         print(f"Error retrieving tours: {str(e)}")
-################################################################
\ No newline at end of file
+################################################################
+
+#################################################################
+#   Loader
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _statements(rows, insert_user, insert_history, insert_duration, batch_size, chunk_size, progress):
+    """Yields (statement, None) for execute_concurrent. Every chunk of rows is grouped by
+    table and partition key, and each group is sent as unlogged batches of at most
+    batch_size statements (a single bound statement when alone in its partition)."""
+    for chunk in _chunks(rows, chunk_size):
+        partitions = {}
+        users = {}
+        for row in chunk:
+            users[row['username']] = row
+            partitions.setdefault(('users_history', row['username']), []).append(insert_history.bind((
+                row['tour_name'], row['location'], row['duration_days'], row['price_per_person'],
+                row['start_date'], row['max_participants'], row['end_date'],
+                row['username'], row['age'], row['state'], row['real_name'], row['email'],
+            )))
+            tour_uuid = tour_id(row['tour_name'], row['location'], row['duration_days'], row['start_date'])
+            bucket = duration_bucket(tour_uuid)
+            partitions.setdefault(('tours_by_duration', row['duration_days'], bucket), []).append(insert_duration.bind((
+                row['duration_days'], bucket, row['start_date'], tour_uuid, row['tour_name'], row['location'],
+                row['price_per_person'], row['max_participants'], row['end_date'],
+            )))
+        for username, row in users.items():
+            partitions[('users', username)] = [insert_user.bind((
+                username, row['age'], row['state'], row['real_name'], row['email'],
+            ))]
+        progress['rows'] += len(chunk)
+        for statements in partitions.values():
+            for i in range(0, len(statements), batch_size):
+                group = statements[i:i + batch_size]
+                if len(group) == 1:
+                    yield group[0], None
+                    continue
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for statement in group:
+                    batch.add(statement)
+                yield batch, None
+
+
+def load_data(repo, rows, concurrency=64, batch_size=20, chunk_size=5000, report_every=100000):
+    """Writes users, users_history and tours_duration from a single pass over rows
+    (see csvsources.read_history) with up to concurrency requests in flight.
+    Returns (rows, requests, errors)."""
+    log.info(f"Loading data with concurrency {concurrency}, batch size {batch_size}")
+    progress = {'rows': 0}
+    statements = _statements(rows, repo.insert_user, repo.insert_user_history, repo.insert_tour_duration,
+                             batch_size, chunk_size, progress)
+    start = time.perf_counter()
+    requests = errors = 0
+    next_report = report_every
+    for success, result in execute_concurrent(repo.session, statements, concurrency=concurrency,
+                                              raise_on_first_error=False, results_generator=True):
+        requests += 1
+        if not success:
+            errors += 1
+            if errors <= 10:
+                log.error(f"Error loading data: {result}")
+        if progress['rows'] >= next_report:
+            next_report += report_every
+            elapsed = time.perf_counter() - start
+            log.info(f"Loaded {progress['rows']} rows, {requests} requests in {elapsed:.1f}s ({progress['rows'] / elapsed:.0f} rows/s)")
+            print(f"Loaded {progress['rows']} rows ({progress['rows'] / elapsed:.0f} rows/s)")
+
+    elapsed = time.perf_counter() - start
+    # execute_concurrent has no per request timings, the load counts as one call
+    metrics.observe('cassandra', 'load_data', elapsed, progress['rows'], error=errors > 0,
+                    params={'concurrency': concurrency, 'batch_size': batch_size, 'requests': requests, 'errors': errors})
+    log.info(f"Loaded {progress['rows']} rows, {requests} requests, {errors} errors in {elapsed:.1f}s")
+    print(f"Loaded {progress['rows']} rows in {elapsed:.1f}s ({progress['rows'] / max(elapsed, 1e-9):.0f} rows/s), {errors} errors")
+    return progress['rows'], requests, errors
+
+
+def migrate_tours_duration(repo, concurrency=64, fetch_size=1000):
+    """Copies the unbucketed tours_duration table of the previous schema into
+    tours_by_duration. Safe to rerun (ids are deterministic); drop tours_duration once done.
+    Returns (rows, errors)."""
+    log.info("Migrating tours_duration to tours_by_duration")
+    legacy = repo.session.execute(SimpleStatement(SELECT_LEGACY_TOURS_DURATION, fetch_size=fetch_size))
+    progress = {'rows': 0}
+
+    def statements():
+        for tour_name, location, duration_days, price_per_person, start_date, max_participants, end_date in legacy:
+            progress['rows'] += 1
+            tour_uuid = tour_id(tour_name, location, duration_days, start_date)
+            yield repo.insert_tour_duration, (duration_days, duration_bucket(tour_uuid), start_date, tour_uuid,
+                                              tour_name, location, price_per_person, max_participants, end_date)
+
+    start = time.perf_counter()
+    errors = 0
+    for success, result in execute_concurrent(repo.session, statements(), concurrency=concurrency,
+                                              raise_on_first_error=False, results_generator=True):
+        if not success:
+            errors += 1
+            if errors <= 10:
+                log.error(f"Error migrating tours_duration: {result}")
+    elapsed = time.perf_counter() - start
+    metrics.observe('cassandra', 'migrate_tours_duration', elapsed, progress['rows'], error=errors > 0,
+                    params={'concurrency': concurrency, 'errors': errors})
+    log.info(f"Migrated {progress['rows']} tours, {errors} errors in {elapsed:.1f}s")
+    print(f"Migrated {progress['rows']} tours in {elapsed:.1f}s, {errors} errors")
+    return progress['rows'], errors
@@ -1,11 +1,130 @@
 #!/usr/bin/env python3
-import datetime
-from datetime import datetime
 import json
-import csv
+import itertools
+import os
 import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import pydgraph
 
+import csvsources
+import metrics
+from locations import city_coordinates, geo_point
+
+# Entries kept by the query cache and seconds before they expire
+DGRAPH_CACHE_SIZE = int(os.getenv('DGRAPH_CACHE_SIZE', '1024'))
+DGRAPH_CACHE_TTL = float(os.getenv('DGRAPH_CACHE_TTL', '300'))
+
+
+class QueryCache:
+    """LRU + TTL cache of query results keyed by query and variables. Every entry is
+    tagged with the uids in its result plus user_<username> / tour_<tour_name> keys,
+    and invalidate drops the entries sharing any tag."""
+
+    def __init__(self, maxsize=DGRAPH_CACHE_SIZE, ttl=DGRAPH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires, result, tags)
+        self._tagged = {}              # tag -> keys
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result, tags):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, result, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tagged.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key, (None, None, ()))
+        for tag in tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+
+query_cache = QueryCache()
+
+# Tag of the cached queries selecting tours by their fields (the geo queries), dropped by
+# every mutation setting a Tour node or one of these predicates
+TOURS_TAG = 'tours'
+TOUR_PREDICATES = {'tour_name', 'location', 'duration_days', 'price_per_person', 'start_date', 'end_date',
+                   'max_participants', 'coordinates'}
+
+
+def _uids(data):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key == 'uid' and isinstance(value, str):
+                yield value[2:] if value.startswith('_:') else value
+            else:
+                yield from _uids(value)
+    elif isinstance(data, list):
+        for item in data:
+            yield from _uids(item)
+
+
+def _sets_tours(data):
+    if isinstance(data, dict):
+        return (data.get('dgraph.type') == 'Tour' or not TOUR_PREDICATES.isdisjoint(data)
+                or any(_sets_tours(value) for value in data.values()))
+    if isinstance(data, list):
+        return any(_sets_tours(item) for item in data)
+    return False
+
+
+def cached_query(client, query, variables, tags=(), operation='query'):
+    """Runs a read-only query through query_cache, tagged with tags and the uids of the result.
+    Queries reaching Dgraph are recorded in metrics as dgraph / operation."""
+    key = (query, tuple(sorted(variables.items())))
+    data = query_cache.get(key)
+    if data is None:
+        with metrics.timed('dgraph', operation, variables) as call:
+            res = client.txn(read_only=True).query(query, variables=variables)
+            data = json.loads(res.json)
+            call.bytes = len(res.json)
+            call.rows = sum(len(nodes) for nodes in data.values() if isinstance(nodes, list))
+        query_cache.put(key, data, set(tags) | set(_uids(data)))
+    return data
+
 
 
 def set_schema(client):
@@ -18,6 +137,7 @@ def set_schema(client):
         state
         friends
         tours
+        pagerank
     }
 
     username: string @index(exact) .
@@ -27,6 +147,7 @@ def set_schema(client):
     state: string @index(term) .
     friends: [uid] @reverse .
     tours: [uid] .
+    pagerank: float @index(float) .
 
     type Tour {
         tour_name
@@ -38,83 +159,174 @@ def set_schema(client):
         max_participants
         participants
         similar_tours
+        popularity
+        coordinates
     }
     
     tour_name: string @index(exact) . 
     location: string .
+    coordinates: geo @index(geo) .
     duration_days: int .
-    price_per_person: float .
-    start_date: datetime .
+    price_per_person: float @index(float) .
+    start_date: datetime @index(hour) .
     end_date: datetime .
     max_participants: int .
     participants: [uid] .
     similar_tours: [uid] .
+    popularity: int @index(int) .
 
     """
     return client.alter(pydgraph.Operation(schema=schema))
 
-def load_data(client):
-    txn = client.txn()
-    try:
-        # Load users from CSV
-        user_data = []
-        with open("./users_data.csv", mode='r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                user_data.append({
-                    'uid': f'_:user_{row["username"]}',
-                    'dgraph.type': 'User',
-                    'username': row['username'],
-                    'real_name': row['real_name'],
-                    'email': row['email'],
-                    'age': int(row['age']),
-                    'state': row['state']
-                })
-        #print(user_data)
-
-        # Load tours from CSV
-        tour_data = []
-        with open("./tours_data.csv", mode='r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                tour_data.append({
-                    'uid': f'_:tour_{row["tour_name"]}',
-                    'dgraph.type': 'Tour',
-                    'tour_name': row['tour_name'],
-                    'location': row['location'],
-                    'duration_days': int(row['duration_days']),
-                    'price_per_person': float(row['price_per_person']),
-                    'start_date': datetime.strptime(row['start_date'], "%Y-%m-%d %H:%M:%S.%f").isoformat(),
-                    'end_date':datetime.strptime(row['end_date'], "%Y-%m-%d %H:%M:%S.%f").isoformat(),
-                    'max_participants': int(row['max_participants']),
-                })
-        #print(tour_data)
-
-
-        # Crear relaciones aleatorias entre usuarios y tours
-        for user in user_data:
-            # Seleccionar entre 1 y 3 tours al azar para cada usuario
-            assigned_tours = random.sample(tour_data, k=random.randint(1, 3))
-            user['tours'] = [{'uid': tour['uid']} for tour in assigned_tours]
-            assigned_friends = random.sample(user_data, k=random.randint(1, 3))
-            user['friends'] = [{'uid': friend['uid']} for friend in assigned_friends]
-
-
-        for tour in tour_data:
-            # Seleccionar entre 1 y 3 tours al azar para cada usuario
-            assigned_tours = random.sample(tour_data, k=random.randint(1, 3))
-            tour['similar_tours'] = [{'uid': tour_s['uid']} for tour_s in assigned_tours]
-            assigned_users = random.sample(user_data, k=random.randint(1, 3))
-            tour['participants'] = [{'uid': user['uid']} for user in assigned_users]
-
-        # Mutate data into Dgraph
-        data = user_data + tour_data
-        #print("data:"+data)
-        txn.mutate(set_obj=data)
-        txn.commit()
-        print("Data imported successfully.")
-    finally:
-        txn.discard()
+def user_node(user):
+    """(blank node key, node) of a csvsources user record."""
+    return f'user_{user["username"]}', {
+        'dgraph.type': 'User',
+        'username': user['username'],
+        'real_name': user['real_name'],
+        'email': user['email'],
+        'age': user['age'],
+        'state': user['state']
+    }
+
+
+def tour_node(tour):
+    """(blank node key, node) of a csvsources tour record."""
+    node = {
+        'dgraph.type': 'Tour',
+        'tour_name': tour['tour_name'],
+        'location': tour['location'],
+        'duration_days': tour['duration_days'],
+        'price_per_person': tour['price_per_person'],
+        'start_date': tour['start_date'].isoformat(),
+        'end_date': tour['end_date'].isoformat(),
+        'max_participants': tour['max_participants'],
+    }
+    # Point of the city for the geo index, tours in unknown places have none
+    coordinates = city_coordinates(tour['location'])
+    if coordinates:
+        node['coordinates'] = geo_point(*coordinates)
+    return f'tour_{tour["tour_name"]}', node
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def mutate_with_retry(client, data, retries=5, backoff=0.2):
+    """Commits set_obj=data in its own transaction, retrying aborted (conflicting)
+    transactions with exponential backoff and jitter, then invalidates the cached queries
+    touching the mutated nodes. Returns the mutation response."""
+    with metrics.timed('dgraph', 'mutate') as call:
+        call.rows = len(data) if isinstance(data, list) else 1
+        for attempt in range(retries + 1):
+            txn = client.txn()
+            try:
+                response = txn.mutate(set_obj=data, commit_now=True)
+                # Blank nodes are tagged by their name (user_<username>), existing nodes by uid
+                tags = set(_uids(data)) | set(response.uids.values())
+                if _sets_tours(data):
+                    tags.add(TOURS_TAG)
+                query_cache.invalidate(tags)
+                return response
+            except (pydgraph.errors.AbortedError, pydgraph.errors.RetriableError):
+                if attempt == retries:
+                    raise
+                time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+            finally:
+                txn.discard()
+
+
+def _run_chunks(client, chunks, workers, retries, backoff, on_response=None):
+    """Mutates every chunk on up to workers concurrent transactions with at most
+    2 * workers chunks in memory. Returns the number of objects written."""
+    written = 0
+
+    def mutate(chunk):
+        response = mutate_with_retry(client, chunk, retries, backoff)
+        if on_response:
+            on_response(response)
+        return len(chunk)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(mutate, chunk))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                written += sum(future.result() for future in done)
+        written += sum(future.result() for future in pending)
+    return written
+
+
+def mutate_chunks(client, objects, chunk_size=1000, workers=4, retries=5, backoff=0.2, on_response=None):
+    """Sets objects (an iterable of set_obj dicts) chunk_size at a time on concurrent,
+    retried transactions. Returns the number of objects written."""
+    return _run_chunks(client, _chunks(objects, chunk_size), workers, retries, backoff, on_response)
+
+
+def _report(what, count, start):
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {count} {what} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} {what}/s)")
+
+
+def load_data(client, chunk_size=1000, workers=4, retries=5, backoff=0.2, tours=None, users=None):
+    """Imports tours and users (csvsources records, read from the default CSVs when not
+    given) in two passes so no transaction holds more than chunk_size objects:
+    nodes first, each chunk with its own blank nodes, whose UIDs are collected from the
+    responses; then the random edges between them, set on those UIDs.
+    Users and tours are keyed by username / tour_name, the first row of a key wins."""
+    tours = csvsources.read_tours() if tours is None else tours
+    users = csvsources.read_users() if users is None else users
+    uids = {}
+    uids_lock = threading.Lock()
+
+    def collect_uids(response):
+        with uids_lock:
+            uids.update(response.uids)
+
+    def nodes():
+        seen = set()
+        for key, node in itertools.chain(map(tour_node, tours), map(user_node, users)):
+            if key in seen:
+                continue
+            seen.add(key)
+            yield {'uid': f'_:{key}', **node}
+
+    start = time.perf_counter()
+    count = mutate_chunks(client, nodes(), chunk_size, workers, retries, backoff, collect_uids)
+    _report("nodes", count, start)
+
+    user_uids = [uid for key, uid in uids.items() if key.startswith('user_')]
+    tour_uids = [uid for key, uid in uids.items() if key.startswith('tour_')]
+
+    def edges():
+        # Crear relaciones aleatorias entre usuarios y tours (entre 1 y 3 de cada una)
+        for uid in user_uids:
+            yield {
+                'uid': uid,
+                'tours': [{'uid': tour} for tour in random.sample(tour_uids, k=min(random.randint(1, 3), len(tour_uids)))],
+                'friends': [{'uid': friend} for friend in random.sample(user_uids, k=min(random.randint(1, 3), len(user_uids)))],
+            }
+        for uid in tour_uids:
+            yield {
+                'uid': uid,
+                'similar_tours': [{'uid': tour} for tour in random.sample(tour_uids, k=min(random.randint(1, 3), len(tour_uids)))],
+                'participants': [{'uid': user} for user in random.sample(user_uids, k=min(random.randint(1, 3), len(user_uids)))],
+            }
+
+    start = time.perf_counter()
+    count = mutate_chunks(client, edges(), chunk_size, workers, retries, backoff)
+    _report("linked nodes", count, start)
+    print("Data imported successfully.")
+    return uids
 
 
 
@@ -133,50 +345,216 @@ def similar_tours(client, tour_name):
         }
     }"""
     variables = {'$tour_name': tour_name}
-    res = client.txn(read_only=True).query(query, variables=variables)
-    data = json.loads(res.json)
+    data = cached_query(client, query, variables, tags=[f'tour_{tour_name}'], operation='similar_tours')
     print(f"Similar tours for {tour_name}: {json.dumps(data, indent=2)}")
 
 
-def friend_tours(client, username):
-    query = """query friend_tours($username: string) {
-        all(func: eq(username, $username)) {
-            uid
-            username
-            friends {
+# Page sizes of the friends / followers lists and of the tours listed per friend.
+# Requested sizes are clamped to DGRAPH_MAX_PAGE so no query fans out past it
+DGRAPH_PAGE_SIZE = int(os.getenv('DGRAPH_PAGE_SIZE', '20'))
+DGRAPH_TOURS_PER_FRIEND = int(os.getenv('DGRAPH_TOURS_PER_FRIEND', '5'))
+DGRAPH_MAX_PAGE = int(os.getenv('DGRAPH_MAX_PAGE', '100'))
+
+UID_PATTERN = re.compile(r'^0x[0-9a-fA-F]+$')
+
+
+def _page_args(first, after=None):
+    """'(first: N, after: 0x..)' for an edge, first clamped to [1, DGRAPH_MAX_PAGE]."""
+    args = [f"first: {max(1, min(int(first), DGRAPH_MAX_PAGE))}"]
+    if after:
+        if not UID_PATTERN.match(after):
+            raise ValueError(f"Invalid uid cursor {after}")
+        args.append(f"after: {after}")
+    return f"({', '.join(args)})"
+
+
+def _next_after(nodes, first):
+    # A full page may be followed by more, its last uid is the cursor of the next one
+    if len(nodes) >= max(1, min(int(first), DGRAPH_MAX_PAGE)):
+        return nodes[-1]['uid']
+    return None
+
+
+def friend_tours(client, username, first=DGRAPH_PAGE_SIZE, after=None, tours_first=DGRAPH_TOURS_PER_FRIEND, count_only=False):
+    """Prints one page of the friends of username with their first tours_first tours and
+    returns the cursor of the next page (None on the last one). With count_only prints
+    the number of friends and the sum of their tour counts instead, read from the count
+    of each friend's tours edge without expanding any tour."""
+    if count_only:
+        query = """query friend_tours($username: string) {
+            var(func: eq(username, $username)) {
+                friends {
+                    n as count(tours)
+                }
+                total as sum(val(n))
+            }
+            all(func: eq(username, $username)) {
+                uid
                 username
-                tours {
-                    tour_name
-                    location
-                    start_date
-                    end_date
+                friend_count: count(friends)
+                friend_tour_count: val(total)
+            }
+        }"""
+    else:
+        query = """query friend_tours($username: string) {
+            all(func: eq(username, $username)) {
+                uid
+                username
+                friends %s {
+                    uid
+                    username
+                    tour_count: count(tours)
+                    tours %s {
+                        uid
+                        tour_name
+                        location
+                        start_date
+                        end_date
+                    }
                 }
             }
-        }
-    }"""
+        }""" % (_page_args(first, after), _page_args(tours_first))
     variables = {'$username': username}
-    res = client.txn(read_only=True).query(query, variables=variables)
-    data = json.loads(res.json)
+    data = cached_query(client, query, variables, tags=[f'user_{username}'], operation='friend_tours')
     print(f"Tours of friends for {username}: {json.dumps(data, indent=2)}")
+    if count_only or not data.get('all'):
+        return None
+    return _next_after(data['all'][0].get('friends', []), first)
 
 
-def follows(client, username):
+def follows(client, username, first=DGRAPH_PAGE_SIZE, friends_after=None, followers_after=None,
+            count_only=False, friends=True, followers=True):
+    """Prints one page of the users username follows (friends) and of the ones following
+    them (~friends), and returns the cursors of the next pages (None once a list is over).
+    friends / followers leave out a list, e.g. once its pages are over. With count_only
+    prints count(friends) and count(~friends) instead."""
+    if count_only:
+        selection = """
+                friend_count: count(friends)
+                follower_count: count(~friends)"""
+    else:
+        selection = ""
+        if friends:
+            selection += """
+                friends %s {
+                    uid
+                    username
+                }""" % _page_args(first, friends_after)
+        if followers:
+            selection += """
+                ~friends %s {
+                    uid
+                    username
+                }""" % _page_args(first, followers_after)
     query = """query user_relationships($username: string) {
-        all(func: eq(username, $username)) {
-            uid
-            username
-            friends {
-                username
-            }
-            ~friends {
-                username
+            all(func: eq(username, $username)) {
+                uid
+                username%s
             }
-        }
-    }"""
+        }""" % selection
     variables = {'$username': username}
-    res = client.txn(read_only=True).query(query, variables=variables)
-    data = json.loads(res.json)
+    data = cached_query(client, query, variables, tags=[f'user_{username}'], operation='follows')
     print(f"Follows of {username}: {json.dumps(data, indent=2)}")
+    if count_only or not data.get('all'):
+        return None, None
+    user = data['all'][0]
+    return (_next_after(user.get('friends', []), first) if friends else None,
+            _next_after(user.get('~friends', []), first) if followers else None)
+
+
+# Tours returned by recommend_tours
+DGRAPH_RECOMMEND_K = int(os.getenv('DGRAPH_RECOMMEND_K', '10'))
+
+
+def recommend_tours(client, username, k=DGRAPH_RECOMMEND_K, depth=1):
+    """Top k tours taken by the friends of username (depth=2 adds the friends of friends),
+    scored by how many of them took each tour and leaving out the user's own tours.
+    Scoring, ranking and the cut to k happen in Dgraph in a single request: every friend
+    carries math(1) down to its tours, where the values reaching a tour are summed."""
+    if depth not in (1, 2):
+        raise ValueError("depth must be 1 or 2")
+    friends_of_friends = """
+            var(func: uid(f1)) {
+                f2 as friends
+            }""" if depth == 2 else ""
+    friends = "f1, f2" if depth == 2 else "f1"
+    query = """query recommend_tours($username: string) {
+            me as var(func: eq(username, $username)) {
+                owned as tours
+                f1 as friends
+            }%s
+            var(func: uid(%s)) @filter(NOT uid(me)) {
+                w as math(1)
+                tours @filter(NOT uid(owned)) {
+                    score as math(w)
+                }
+            }
+            traversed(func: uid(me, %s)) {
+                uid
+            }
+            recommendations(func: uid(score), orderdesc: val(score), orderasc: tour_name, first: %d) {
+                uid
+                tour_name
+                location
+                duration_days
+                price_per_person
+                start_date
+                score: val(score)
+            }
+        }""" % (friends_of_friends, friends, friends, max(1, min(int(k), DGRAPH_MAX_PAGE)))
+    variables = {'$username': username}
+    # The uids of the user and of the friends walked tag the result, edges added to them by uid invalidate it
+    data = cached_query(client, query, variables, tags=[f'user_{username}'], operation='recommend_tours')
+    print(f"Recommended tours for {username}: {json.dumps(data, indent=2)}")
+    return data.get('recommendations', [])
+
+
+def _geo_tours(client, name, root, min_price=None, max_price=None, start_from=None, start_to=None,
+               first=DGRAPH_PAGE_SIZE, predicate='coordinates'):
+    """Runs the geo root function (served by the geo index) with the price / start date
+    bounds given as filters, cheapest tours first."""
+    declarations, filters, variables = [], [], {}
+    for var, kind, op, field, value in (
+            ('min_price', 'float', 'ge', 'price_per_person', min_price),
+            ('max_price', 'float', 'le', 'price_per_person', max_price),
+            ('start_from', 'string', 'ge', 'start_date', start_from),
+            ('start_to', 'string', 'le', 'start_date', start_to)):
+        if value is None:
+            continue
+        declarations.append(f"${var}: {kind}")
+        filters.append(f"{op}({field}, ${var})")
+        variables[f"${var}"] = str(value)
+    query = """%s{
+            tours(func: %s, orderasc: price_per_person, first: %d) %s {
+                uid
+                tour_name
+                location
+                %s
+                duration_days
+                price_per_person
+                start_date
+                end_date
+            }
+        }""" % (f"query {name}({', '.join(declarations)}) " if declarations else "", root,
+                max(1, min(int(first), DGRAPH_MAX_PAGE)),
+                f"@filter({' AND '.join(filters)})" if filters else "", predicate)
+    # Any tour written may enter the results, not only the uids returned
+    return cached_query(client, query, variables, tags=[TOURS_TAG], operation=name).get('tours', [])
+
 
+def tours_near(client, latitude, longitude, radius_km, min_price=None, max_price=None,
+               start_from=None, start_to=None, first=DGRAPH_PAGE_SIZE, predicate='coordinates'):
+    """Tours within radius_km of (latitude, longitude), optionally bounded by price and
+    start date (ISO 8601)."""
+    root = f"near({predicate}, [{float(longitude)}, {float(latitude)}], {int(float(radius_km) * 1000)})"
+    return _geo_tours(client, 'tours_near', root, min_price, max_price, start_from, start_to, first, predicate)
 
 
+def tours_within(client, polygon, min_price=None, max_price=None,
+                 start_from=None, start_to=None, first=DGRAPH_PAGE_SIZE, predicate='coordinates'):
+    """Tours inside polygon, a list of (latitude, longitude) vertices."""
+    ring = [[float(lon), float(lat)] for lat, lon in polygon]
+    if ring[0] != ring[-1]:
+        ring.append(ring[0])
+    root = f"within({predicate}, {json.dumps([ring])})"
+    return _geo_tours(client, 'tours_within', root, min_price, max_price, start_from, start_to, first, predicate)
@@ -1,25 +1,76 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+import anyio
+import asyncio
 import os
 
-from mongoroutes import router as mongo_router
+import jsonlog
+import metrics
+from mongoroutes import router as sync_router
+from mongoasyncroutes import router as async_router
+from mongoindexes import ensure_indexes, ensure_indexes_async
+from mongosummary import ensure_summary, ensure_summary_async
+from toursearch import TourSearchIndex, RESULT_FIELDS
 
 
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
 DB_NAME = os.getenv('MONGODB_DB_NAME', 'Proyect')
+# sync: pymongo + def routes on the threadpool, async: motor + async def routes
+MONGODB_DRIVER = os.getenv('MONGODB_DRIVER', 'sync')
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '100'))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+# Threads serving the sync routes (anyio defaults to 40)
+API_THREADPOOL_SIZE = int(os.getenv('API_THREADPOOL_SIZE', '40'))
 
-app = FastAPI()
 
-@app.on_event("startup")
-def startup_db_client():
-    app.mongodb_client = MongoClient(MONGODB_URI)
-    app.database = app.mongodb_client[DB_NAME]
-    print(f"Connected to MongoDB at: {MONGODB_URI} \n\t Database: {DB_NAME}")
-
-@app.on_event("shutdown")
-def shutdown_db_client():
+@asynccontextmanager
+async def lifespan(app):
+    jsonlog.setup_logging()
+    if MONGODB_DRIVER == "async":
+        app.mongodb_client = AsyncIOMotorClient(MONGODB_URI, maxPoolSize=MONGODB_MAX_POOL_SIZE, minPoolSize=MONGODB_MIN_POOL_SIZE)
+        app.database = app.mongodb_client[DB_NAME]
+        print(f"Connected to MongoDB (async) at: {MONGODB_URI} \n\t Database: {DB_NAME}")
+        # The event loop holds tasks weakly, keep the builds until shutdown
+        app.index_builders = await ensure_indexes_async(app.database)
+        rebuilt = await ensure_summary_async(app.database)
+        if rebuilt is not None:
+            print(f"Tours summary built: {rebuilt} tour names")
+        app.tour_search = await TourSearchIndex.from_cursor_async(app.database["tours"].find({}, RESULT_FIELDS))
+        print(f"Search index built: {len(app.tour_search)} tours")
+    else:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+        app.mongodb_client = MongoClient(MONGODB_URI, maxPoolSize=MONGODB_MAX_POOL_SIZE, minPoolSize=MONGODB_MIN_POOL_SIZE)
+        app.database = app.mongodb_client[DB_NAME]
+        print(f"Connected to MongoDB at: {MONGODB_URI} \n\t Database: {DB_NAME}")
+        ensure_indexes(app.database)
+        rebuilt = ensure_summary(app.database)
+        if rebuilt is not None:
+            print(f"Tours summary built: {rebuilt} tour names")
+        app.tour_search = TourSearchIndex.from_documents(app.database["tours"].find({}, RESULT_FIELDS))
+        print(f"Search index built: {len(app.tour_search)} tours")
+    yield
+    if MONGODB_DRIVER == "async":
+        # Unfinished builds keep running on the server, only the wait for them is cancelled
+        for builder in app.index_builders:
+            builder.cancel()
+        await asyncio.gather(*app.index_builders, return_exceptions=True)
     app.mongodb_client.close()
     print("Bye bye...!!")
+    jsonlog.stop_logging()
+
+
+app = FastAPI(lifespan=lifespan)
 
+mongo_router = async_router if MONGODB_DRIVER == "async" else sync_router
 app.include_router(mongo_router, tags=["tours"], prefix="/tours")
-app.include_router(mongo_router, tags=["users"], prefix="/users")
\ No newline at end of file
+app.include_router(mongo_router, tags=["users"], prefix="/users")
+
+
+@app.get("/metrics", response_description="Latency, errors, rows and bytes of the routes of this process")
+def get_metrics(format: str = "json"):
+    if format == "prometheus":
+        return PlainTextResponse(metrics.registry.prometheus())
+    return metrics.registry.snapshot()
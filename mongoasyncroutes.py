@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Same API as mongoroutes on top of motor, used when MONGODB_DRIVER=async (see mongoBack)
+from fastapi import APIRouter, Body, Request, Response, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from typing import List
+from pymongo import ReturnDocument
+
+import mongosummary
+from mongomodel import Tour, User, ToursUpdate, UserUpdate
+from mongopaging import find_page_async, find_sorted, NEXT_TOKEN_HEADER
+from mongoquery import tours_query, summarize_explain
+from mongostream import ndjson_response_async, wants_stream
+from mongobulk import bulk_insert, tour_document, tour_update, user_document, DEFAULT_CHUNK_SIZE
+from mongojson import MongoJSONResponse, with_write_concern
+from mongometrics import MetricsRoute
+from toursearch import DEFAULT_SEARCH_LIMIT
+from mongoroutes import USERS_SORT
+
+router = APIRouter(route_class=MetricsRoute)
+
+
+async def on_tours_inserted(app, tours):
+    await mongosummary.apply_async(app.database, added=tours)
+    app.tour_search.add_many(tours)
+
+@router.post("/T", response_description="Post a new Tour", status_code=status.HTTP_201_CREATED, response_model=Tour)
+async def create_tour(request: Request, tour: Tour = Body(...)):
+    tour = tour_document(tour)
+    await with_write_concern(request.app.database["tours"], "create_tour").insert_one(tour)
+    await mongosummary.apply_async(request.app.database, added=[tour])
+    request.app.tour_search.add(tour)
+    return MongoJSONResponse(tour, status_code=status.HTTP_201_CREATED)
+
+@router.post("/U", response_description="Post a new User", status_code=status.HTTP_201_CREATED, response_model=User)
+async def create_user(request: Request, user: User = Body(...)):
+    user = user_document(user)
+    await with_write_concern(request.app.database["users"], "create_user").insert_one(user)
+    return MongoJSONResponse(user, status_code=status.HTTP_201_CREATED)
+
+@router.post("/T/bulk", response_description="Post many Tours as a JSON array or NDJSON", status_code=status.HTTP_201_CREATED)
+async def create_tours_bulk(request: Request, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    tours = with_write_concern(request.app.database["tours"], "create_tours_bulk")
+    return await bulk_insert(request, tours, Tour, tour_document, chunk_size, is_async=True,
+                             on_insert=lambda tours: on_tours_inserted(request.app, tours))
+
+@router.post("/U/bulk", response_description="Post many Users as a JSON array or NDJSON", status_code=status.HTTP_201_CREATED)
+async def create_users_bulk(request: Request, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    users = with_write_concern(request.app.database["users"], "create_users_bulk")
+    return await bulk_insert(request, users, User, user_document, chunk_size, is_async=True)
+
+@router.get("/U", response_description="Get all Users", response_model=List[User])
+async def list_users(request: Request, limit: int = 0, after: str = None, stream: bool = False):
+    if wants_stream(request, stream):
+        cursor = find_sorted(request.app.database["users"], {}, USERS_SORT, after)
+        return ndjson_response_async(cursor.limit(max(limit, 0)))
+    users, next_token = await find_page_async(request.app.database["users"], {}, USERS_SORT, limit, after)
+    return MongoJSONResponse(users, headers={NEXT_TOKEN_HEADER: next_token} if next_token else None)
+
+@router.get("/T", response_description="Get all tours", response_model=List[Tour])
+async def list_tours(request: Request, start_date_From: str=None, start_date_To: str=None, min_price: float=None, max_price: float=None, location: str=None, sort: str=None, fields: str=None, limit: int = 0, after: str = None, stream: bool = False):
+    req, sort, projection = tours_query(start_date_From, start_date_To, min_price, max_price, location, sort, fields)
+    if wants_stream(request, stream):
+        cursor = find_sorted(request.app.database["tours"], req, sort, after, projection)
+        return ndjson_response_async(cursor.limit(max(limit, 0)))
+    tours, next_token = await find_page_async(request.app.database["tours"], req, sort, limit, after, projection)
+    return MongoJSONResponse(tours, headers={NEXT_TOKEN_HEADER: next_token} if next_token else None)
+
+@router.get("/T/explain", response_description="Query plan of GET /T for the same parameters")
+async def explain_tours(request: Request, start_date_From: str=None, start_date_To: str=None, min_price: float=None, max_price: float=None, location: str=None, sort: str=None, fields: str=None, limit: int = 0, after: str = None):
+    req, sort, projection = tours_query(start_date_From, start_date_To, min_price, max_price, location, sort, fields)
+    cursor = find_sorted(request.app.database["tours"], req, sort, after, projection).limit(max(limit, 0))
+    summary = summarize_explain(await cursor.explain())
+    return jsonable_encoder({"filter": req, "sort": sort, "projection": projection, **summary})
+
+@router.get("/T/general_info", response_description="Get general info")
+async def general_info_tours(request: Request):
+    # Read from the summary kept by the write routes instead of aggregating every tour
+    summaries = await request.app.database[mongosummary.SUMMARY_COLLECTION].find({}).sort("_id").to_list(length=None)
+    return MongoJSONResponse([mongosummary.general_info(summary) for summary in summaries])
+
+@router.get("/T/search", response_description="Tours whose name or location match every word of q (as prefixes)")
+async def search_tours(request: Request, q: str, limit: int = DEFAULT_SEARCH_LIMIT):
+    # Served by the in-memory index kept by the tour write routes, Mongo is not queried
+    return MongoJSONResponse(request.app.tour_search.search(q, limit))
+
+@router.get("/T/suggest", response_description="Indexed words starting with the last word of q")
+async def suggest_tours(request: Request, q: str, limit: int = 10):
+    return MongoJSONResponse(request.app.tour_search.suggest(q, limit))
+
+@router.get("/T/{id}", response_description="Get a single tour by id", response_model=Tour)
+async def find_tour(id: str, request: Request):
+    if (tour := await request.app.database["tours"].find_one({"_id": id})) is not None:
+        return MongoJSONResponse(tour)
+
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Tour with ID {id} not found")
+
+
+@router.put("/T/{id}", response_description="Update a tour by id", response_model=Tour)
+async def update_tour(id: str, request: Request, tour: ToursUpdate = Body(...)):
+    new_data = tour_update(tour)
+    # The old document feeds the summary delta, the new one is rebuilt from it locally
+    old_tour = await with_write_concern(request.app.database["tours"], "update_tour").find_one_and_update(
+        {"_id": id}, {"$set": new_data}, return_document=ReturnDocument.BEFORE
+    )
+    if old_tour is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Tour with ID {id} not found")
+    updated_tour = {**old_tour, **new_data}
+    await mongosummary.apply_async(request.app.database, added=[updated_tour], removed=[old_tour])
+    request.app.tour_search.add(updated_tour)
+    return MongoJSONResponse(updated_tour)
+
+
+@router.delete("/T/{id}", response_description="Delete a tour")
+async def delete_tour(id: str, request: Request):
+    old_tour = await with_write_concern(request.app.database["tours"], "delete_tour").find_one_and_delete({"_id": id})
+    if old_tour is not None:
+        await mongosummary.apply_async(request.app.database, removed=[old_tour])
+        request.app.tour_search.remove(id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
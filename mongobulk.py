@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import json
+from datetime import datetime, timezone
+from fastapi import HTTPException, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+DEFAULT_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 10000
+
+
+def bson_datetime(value):
+    """The datetime as Mongo stores and returns it: naive UTC with millisecond precision,
+    so a document echoed back after a write matches what a later read returns."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def tour_document(tour):
+    tour = jsonable_encoder(tour)
+    tour["start_date"] = bson_datetime(datetime.fromisoformat(tour["start_date"]))
+    tour["end_date"] = bson_datetime(datetime.fromisoformat(tour["end_date"]))
+    return tour
+
+
+def tour_update(tour):
+    """$set document of a ToursUpdate. Null fields are left as they are: every field of a
+    tour is required, and the summary sums the price and participants being replaced."""
+    update = tour.dict(exclude_unset=True, exclude_none=True)
+    for field in ("start_date", "end_date"):
+        if update.get(field) is not None:
+            update[field] = bson_datetime(update[field])
+    return update
+
+
+def user_document(user):
+    return jsonable_encoder(user)
+
+
+async def iter_body(request: Request):
+    """Yields (index, item) for every document of the body.
+    item is the parsed dict, or an Exception for NDJSON lines that are not valid JSON.
+    A JSON array is read at once, an NDJSON body is parsed line by line as it streams in."""
+    if request.headers.get("content-type", "").split(";")[0].strip() != NDJSON_MEDIA_TYPE:
+        try:
+            items = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON body: {e}")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array of documents")
+        for index, item in enumerate(items):
+            yield index, item
+        return
+
+    index = 0
+    pending = b""
+    async for data in request.stream():
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            yield index, _parse_line(line)
+            index += 1
+    if pending.strip():
+        yield index, _parse_line(pending)
+
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+def validate_chunk(chunk, model, to_document):
+    """Validates a list of (index, item) with the pydantic model.
+    Returns the documents to insert, their body indexes and the per-item errors."""
+    documents, indexes, errors = [], [], []
+    for index, item in chunk:
+        if isinstance(item, Exception):
+            errors.append({"index": index, "error": f"Invalid JSON: {item}"})
+            continue
+        try:
+            documents.append(to_document(model.parse_obj(item)))
+            indexes.append(index)
+        except ValidationError as e:
+            errors.append({"index": index, "error": [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()]})
+    return documents, indexes, errors
+
+
+def insert_chunk(collection, documents, indexes):
+    """Unordered insert_many of a validated chunk, returns (inserted, errors)."""
+    if not documents:
+        return 0, []
+    try:
+        result = collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids), []
+    except BulkWriteError as e:
+        return _bulk_write_errors(e, indexes)
+
+
+async def insert_chunk_async(collection, documents, indexes):
+    """insert_chunk for a motor collection."""
+    if not documents:
+        return 0, []
+    try:
+        result = await collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids), []
+    except BulkWriteError as e:
+        return _bulk_write_errors(e, indexes)
+
+
+def _bulk_write_errors(e, indexes):
+    errors = [
+        {"index": indexes[err["index"]], "error": err["errmsg"], "code": err["code"]}
+        for err in e.details.get("writeErrors", [])
+    ]
+    return e.details.get("nInserted", 0), errors
+
+
+def _inserted(documents, indexes, write_errors):
+    failed = {error["index"] for error in write_errors}
+    return [doc for doc, index in zip(documents, indexes) if index not in failed]
+
+
+def _write_chunk(collection, chunk, model, to_document, on_insert=None):
+    documents, indexes, errors = validate_chunk(chunk, model, to_document)
+    inserted, write_errors = insert_chunk(collection, documents, indexes)
+    if on_insert and inserted:
+        on_insert(_inserted(documents, indexes, write_errors))
+    return inserted, errors + write_errors
+
+
+async def _write_chunk_threaded(collection, chunk, model, to_document, on_insert=None):
+    return await run_in_threadpool(_write_chunk, collection, chunk, model, to_document, on_insert)
+
+
+async def _write_chunk_async(collection, chunk, model, to_document, on_insert=None):
+    documents, indexes, errors = await run_in_threadpool(validate_chunk, chunk, model, to_document)
+    inserted, write_errors = await insert_chunk_async(collection, documents, indexes)
+    if on_insert and inserted:
+        await on_insert(_inserted(documents, indexes, write_errors))
+    return inserted, errors + write_errors
+
+
+async def bulk_insert(request: Request, collection, model, to_document, chunk_size=DEFAULT_CHUNK_SIZE, is_async=False, on_insert=None):
+    """Validates and inserts the body in chunks of chunk_size documents, one chunk at a time.
+    Validation runs in the threadpool; so does insert_many unless collection is a motor
+    collection (is_async). on_insert gets the documents actually inserted of every chunk
+    (a coroutine function when is_async)."""
+    write_chunk = _write_chunk_async if is_async else _write_chunk_threaded
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    inserted, received, errors = 0, 0, []
+    chunk = []
+    async for item in iter_body(request):
+        chunk.append(item)
+        received += 1
+        if len(chunk) >= chunk_size:
+            chunk_inserted, chunk_errors = await write_chunk(collection, chunk, model, to_document, on_insert)
+            inserted += chunk_inserted
+            errors.extend(chunk_errors)
+            chunk = []
+    if chunk:
+        chunk_inserted, chunk_errors = await write_chunk(collection, chunk, model, to_document, on_insert)
+        inserted += chunk_inserted
+        errors.extend(chunk_errors)
+    request.state.rows = inserted
+    return {"received": received, "inserted": inserted, "errors": errors}
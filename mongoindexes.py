@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import asyncio
+import threading
+from pymongo import ASCENDING, TEXT, IndexModel
+
+# Wanted indexes per collection, checked once at API startup (see mongoBack)
+INDEXES = {
+    "tours": [
+        # Date range and/or date order (the default sort), _id is the keyset tie-breaker
+        IndexModel([("start_date", ASCENDING), ("_id", ASCENDING)], name="start_date_1__id_1", background=True),
+        # Date range combined with a price range
+        IndexModel([("start_date", ASCENDING), ("price_per_person", ASCENDING)], name="start_date_1_price_per_person_1", background=True),
+        # Price range and/or price order
+        IndexModel([("price_per_person", ASCENDING), ("_id", ASCENDING)], name="price_per_person_1__id_1", background=True),
+        IndexModel([("location", TEXT)], name="location_text", background=True),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_1", background=True),
+    ],
+}
+
+
+def _keys(spec):
+    # Text indexes are reported by the server as _fts/_ftsx, compare the weights instead
+    if "weights" in spec:
+        return sorted((field, TEXT) for field in spec["weights"])
+    return [(field, direction) for field, direction in spec["key"]]
+
+
+def _wanted_keys(index):
+    doc = index.document
+    if TEXT in doc["key"].values():
+        return sorted((field, TEXT) for field, kind in doc["key"].items() if kind == TEXT)
+    return list(doc["key"].items())
+
+
+def diff_indexes(collection, wanted):
+    """Compare the wanted IndexModels with the ones on the collection.
+    Returns (missing, drift): the IndexModels to build and a list of drift messages."""
+    return _diff(collection.name, collection.index_information(), wanted)
+
+
+def _diff(collection_name, existing, wanted):
+    missing = []
+    drift = []
+    wanted_names = set()
+    for index in wanted:
+        name = index.document["name"]
+        wanted_names.add(name)
+        if name not in existing:
+            missing.append(index)
+        elif _keys(existing[name]) != _wanted_keys(index):
+            drift.append(f"{collection_name}.{name}: keys {_keys(existing[name])} != wanted {_wanted_keys(index)}")
+    for name in existing:
+        if name != "_id_" and name not in wanted_names:
+            drift.append(f"{collection_name}.{name}: not declared in mongoindexes.INDEXES")
+    return missing, drift
+
+
+def _build(collection, missing):
+    try:
+        names = collection.create_indexes(missing)
+        print(f"Built indexes on {collection.name}: {', '.join(names)}")
+    except Exception as e:
+        print(f"Error building indexes on {collection.name}: {e}")
+
+
+def ensure_indexes(database, indexes=INDEXES, wait=False):
+    """Build the missing indexes of the registry and report drift.
+    Builds run on a background thread unless wait is set; the threads are returned."""
+    builders = []
+    for collection_name, wanted in indexes.items():
+        collection = database[collection_name]
+        missing, drift = diff_indexes(collection, wanted)
+        for message in drift:
+            print(f"Index drift: {message}")
+        if not missing:
+            continue
+        builder = threading.Thread(target=_build, args=(collection, missing), daemon=True)
+        builder.start()
+        builders.append(builder)
+    if wait:
+        for builder in builders:
+            builder.join()
+    return builders
+
+
+async def _build_async(collection, missing):
+    try:
+        names = await collection.create_indexes(missing)
+        print(f"Built indexes on {collection.name}: {', '.join(names)}")
+    except Exception as e:
+        print(f"Error building indexes on {collection.name}: {e}")
+
+
+async def ensure_indexes_async(database, indexes=INDEXES, wait=False):
+    """ensure_indexes for a motor database, the builds run as background tasks."""
+    builders = []
+    for collection_name, wanted in indexes.items():
+        collection = database[collection_name]
+        missing, drift = _diff(collection_name, await collection.index_information(), wanted)
+        for message in drift:
+            print(f"Index drift: {message}")
+        if missing:
+            builders.append(asyncio.create_task(_build_async(collection, missing)))
+    if wait:
+        await asyncio.gather(*builders)
+    return builders
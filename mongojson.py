@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import os
+from functools import lru_cache
+import orjson
+from fastapi.responses import JSONResponse
+from pymongo import WriteConcern
+
+
+def _default(value):
+    # orjson handles datetime and UUID itself, this covers ObjectId and Decimal128
+    return str(value)
+
+
+def dumps(content):
+    return orjson.dumps(content, default=_default)
+
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response for documents read from Mongo, encoded with orjson as they are.
+    Returning it from a route skips the response_model validation, so it is meant for
+    documents the API itself wrote and validated."""
+
+    def render(self, content):
+        # Documents returned, read by mongometrics.MetricsRoute
+        self.rows = len(content) if isinstance(content, list) else 1
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def write_concern(route):
+    """MONGODB_WRITE_CONCERN_<ROUTE> (e.g. MONGODB_WRITE_CONCERN_CREATE_TOURS_BULK), else
+    MONGODB_WRITE_CONCERN, else the client default. Values: 0, 1, 2... or majority."""
+    w = os.getenv(f"MONGODB_WRITE_CONCERN_{route.upper()}", os.getenv("MONGODB_WRITE_CONCERN"))
+    if w is None:
+        return None
+    return WriteConcern(w=int(w) if w.isdigit() else w)
+
+
+def with_write_concern(collection, route):
+    concern = write_concern(route)
+    return collection if concern is None else collection.with_options(write_concern=concern)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import time
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+
+import metrics
+
+
+async def _observed_stream(body, operation, start, params):
+    rows = nbytes = 0
+    error = True
+    try:
+        async for chunk in body:
+            rows += chunk.count(b"\n")   # NDJSON, one document per line
+            nbytes += len(chunk)
+            yield chunk
+        error = False
+    finally:
+        metrics.observe("mongo", operation, time.perf_counter() - start, rows, nbytes, error, params)
+
+
+class MetricsRoute(APIRoute):
+    """Records every call of the route in metrics as mongo / '<METHOD> <path>': the
+    latency from the request to the rendered response (to the last line for streamed
+    responses), the documents returned (MongoJSONResponse.rows, request.state.rows or
+    NDJSON lines) and the body size. Client errors (4xx) are not counted as errors."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        methods = ','.join(sorted(self.methods))
+        depth = self.path.rstrip("/").count("/")
+
+        async def observed_handler(request):
+            start = time.perf_counter()
+            # The router is included under several prefixes (/tours, /users), the path
+            # template doesn't carry it: keep the segments of the URL above the template
+            segments = request.scope["path"].rstrip("/").split("/")
+            operation = f"{methods} {'/'.join(segments[:len(segments) - depth])}{self.path}"
+            params = {**request.path_params, **request.query_params}
+            rows = nbytes = 0
+            error = True
+            try:
+                response = await handler(request)
+                if isinstance(response, StreamingResponse):
+                    response.body_iterator = _observed_stream(response.body_iterator, operation, start, params)
+                    start = None
+                    return response
+                error = response.status_code >= 500
+                rows = getattr(response, "rows", None) or getattr(request.state, "rows", 0)
+                nbytes = len(response.body)
+                return response
+            except HTTPException as e:
+                error = e.status_code >= 500
+                raise
+            except RequestValidationError:
+                error = False
+                raise
+            finally:
+                if start is not None:
+                    metrics.observe("mongo", operation, time.perf_counter() - start, rows, nbytes, error, params)
+
+        return observed_handler
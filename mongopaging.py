@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import base64
+import binascii
+from bson import json_util
+from fastapi import HTTPException, status
+from pymongo import ASCENDING
+
+# Continuation tokens are sent and received in this header
+NEXT_TOKEN_HEADER = "X-Next-Token"
+
+
+def encode_token(doc, sort):
+    values = [doc.get(field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_token(token, sort):
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid continuation token")
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid continuation token")
+    return values
+
+
+def keyset_filter(sort, values):
+    """Filter for the documents strictly after values in the sort order, i.e. for
+    sort [(a, 1), (_id, 1)]: a > va OR (a == va AND _id > vid)."""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev: values[j] for j, (prev, _) in enumerate(sort[:i])}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def find_sorted(collection, query, sort, after=None, projection=None):
+    """Cursor over the documents of query after the token, in sort order."""
+    if after:
+        after_filter = keyset_filter(sort, decode_token(after, sort))
+        query = {"$and": [query, after_filter]} if query else after_filter
+    return collection.find(query, projection).sort(sort)
+
+
+def find_page(collection, query, sort, limit, after=None, projection=None):
+    """Returns (docs, next_token). sort must end with a unique key (_id) and be backed
+    by an index so every page costs the same no matter how deep it is.
+    With limit <= 0 the whole result is returned and next_token is None."""
+    cursor = find_sorted(collection, query, sort, after, projection)
+    if limit <= 0:
+        return list(cursor), None
+    # One extra document tells whether there is a next page
+    return _page(list(cursor.limit(limit + 1)), sort, limit)
+
+
+async def find_page_async(collection, query, sort, limit, after=None, projection=None):
+    """find_page for a motor collection."""
+    cursor = find_sorted(collection, query, sort, after, projection)
+    if limit <= 0:
+        return await cursor.to_list(length=None), None
+    return _page(await cursor.limit(limit + 1).to_list(length=None), sort, limit)
+
+
+def _page(docs, sort, limit):
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_token(docs[-1], sort)
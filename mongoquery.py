@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+from datetime import datetime
+from fastapi import HTTPException, status
+from pymongo import ASCENDING, DESCENDING
+
+# Fields of Tour that can be sorted on / projected, see mongoindexes for the matching indexes
+TOUR_SORT_FIELDS = {"start_date", "end_date", "price_per_person", "duration_days", "max_participants", "tour_name"}
+TOUR_FIELDS = TOUR_SORT_FIELDS | {"location"}
+DEFAULT_TOURS_SORT = "start_date"
+
+
+def parse_date(value, name):
+    # Accepts '2025-09-04 09:55:17.905467' as well as any other ISO 8601 date
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid date for {name}: {value}")
+
+
+def parse_sort(sort):
+    """'price_per_person,-start_date' -> [(price_per_person, 1), (start_date, -1), (_id, 1)].
+    _id is always appended as tie-breaker, in the direction of the first key so that a
+    single-direction index can be walked backwards."""
+    spec = []
+    for field in (sort or DEFAULT_TOURS_SORT).split(","):
+        field = field.strip()
+        direction = DESCENDING if field.startswith("-") else ASCENDING
+        field = field.lstrip("-+")
+        if field not in TOUR_SORT_FIELDS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Can't sort tours by {field}")
+        spec.append((field, direction))
+    spec.append(("_id", spec[0][1]))
+    return spec
+
+
+def parse_fields(fields, sort):
+    """Projection for the comma separated fields. The sort keys are always kept because
+    the continuation token is built from them."""
+    if not fields:
+        return None
+    projection = {}
+    for field in fields.split(","):
+        field = field.strip()
+        if field not in TOUR_FIELDS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown tour field {field}")
+        projection[field] = 1
+    for field, _ in sort:
+        projection[field] = 1
+    return projection
+
+
+def tours_query(start_date_From=None, start_date_To=None, min_price=None, max_price=None, location=None, sort=None, fields=None):
+    """Composes every given filter into a single query.
+    Returns (filter, sort, projection) for find_sorted/find_page."""
+    req = {}
+    if start_date_From is not None or start_date_To is not None:
+        req["start_date"] = {}
+        if start_date_From is not None:
+            req["start_date"]["$gte"] = parse_date(start_date_From, "start_date_From")
+        if start_date_To is not None:
+            req["start_date"]["$lte"] = parse_date(start_date_To, "start_date_To")
+    if min_price is not None or max_price is not None:
+        req["price_per_person"] = {}
+        if min_price is not None:
+            req["price_per_person"]["$gte"] = min_price
+        if max_price is not None:
+            req["price_per_person"]["$lte"] = max_price
+    if location is not None:
+        req["$text"] = {"$search": location}
+    sort = parse_sort(sort)
+    return req, sort, parse_fields(fields, sort)
+
+
+def _walk(plan):
+    yield plan
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _walk(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _walk(child)
+
+
+def summarize_explain(explain):
+    """Winning plan, indexes used and keys/docs examined of a find explain."""
+    winning_plan = explain["queryPlanner"]["winningPlan"]
+    stages = list(_walk(winning_plan))
+    stats = explain.get("executionStats", {})
+    return {
+        "winning_plan": winning_plan,
+        "stages": [stage["stage"] for stage in stages if "stage" in stage],
+        "indexes": [stage["indexName"] for stage in stages if "indexName" in stage],
+        "collection_scan": any(stage.get("stage") == "COLLSCAN" for stage in stages),
+        "blocking_sort": any(stage.get("stage") == "SORT" for stage in stages),
+        "n_returned": stats.get("nReturned"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "execution_time_ms": stats.get("executionTimeMillis"),
+    }
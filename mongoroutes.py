@@ -2,89 +2,123 @@
 from fastapi import APIRouter, Body, Request, Response, HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from typing import List
-from datetime import datetime
-from pymongo import TEXT
+from pymongo import ASCENDING, ReturnDocument
 
+import mongosummary
 from mongomodel import Tour, User, ToursUpdate, UserUpdate
+from mongopaging import find_page, find_sorted, NEXT_TOKEN_HEADER
+from mongoquery import tours_query, summarize_explain
+from mongostream import ndjson_response, wants_stream
+from mongobulk import bulk_insert, tour_document, tour_update, user_document, DEFAULT_CHUNK_SIZE
+from mongojson import MongoJSONResponse, with_write_concern
+from mongometrics import MetricsRoute
+from toursearch import DEFAULT_SEARCH_LIMIT
 
-router = APIRouter()
+router = APIRouter(route_class=MetricsRoute)
+
+
+def on_tours_inserted(app, tours):
+    mongosummary.apply(app.database, added=tours)
+    app.tour_search.add_many(tours)
+
+# Keyset pagination order for users, tours are sorted by mongoquery.parse_sort
+USERS_SORT = [("_id", ASCENDING)]
+
+# Routes answer with MongoJSONResponse: documents written by the API are echoed back
+# instead of read again, and documents read from Mongo are encoded without going
+# through response_model (which is kept for the OpenAPI schema).
 
 @router.post("/T", response_description="Post a new Tour", status_code=status.HTTP_201_CREATED, response_model=Tour)
 def create_tour(request: Request, tour: Tour = Body(...)):
-    tour = jsonable_encoder(tour)
-    tour["end_date"] = datetime.strptime(tour["end_date"], "%Y-%m-%dT%H:%M:%S.%f")
-    tour["start_date"] = datetime.strptime(tour["start_date"], "%Y-%m-%dT%H:%M:%S.%f")
-    new_tour = request.app.database["tours"].insert_one(tour)
-    created_tour = request.app.database["tours"].find_one(
-        {"_id": new_tour.inserted_id}
-    )
+    tour = tour_document(tour)
+    with_write_concern(request.app.database["tours"], "create_tour").insert_one(tour)
+    mongosummary.apply(request.app.database, added=[tour])
+    request.app.tour_search.add(tour)
+    return MongoJSONResponse(tour, status_code=status.HTTP_201_CREATED)
 
-    return created_tour
 @router.post("/U", response_description="Post a new User", status_code=status.HTTP_201_CREATED, response_model=User)
 def create_user(request: Request, user: User = Body(...)):
-    user = jsonable_encoder(user)
-    new_user = request.app.database["users"].insert_one(user)
-    created_user = request.app.database["users"].find_one(
-        {"_id": new_user.inserted_id}
-    )
+    user = user_document(user)
+    with_write_concern(request.app.database["users"], "create_user").insert_one(user)
+    return MongoJSONResponse(user, status_code=status.HTTP_201_CREATED)
 
-    return created_user
+@router.post("/T/bulk", response_description="Post many Tours as a JSON array or NDJSON", status_code=status.HTTP_201_CREATED)
+async def create_tours_bulk(request: Request, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    tours = with_write_concern(request.app.database["tours"], "create_tours_bulk")
+    return await bulk_insert(request, tours, Tour, tour_document, chunk_size,
+                             on_insert=lambda tours: on_tours_inserted(request.app, tours))
+
+@router.post("/U/bulk", response_description="Post many Users as a JSON array or NDJSON", status_code=status.HTTP_201_CREATED)
+async def create_users_bulk(request: Request, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    users = with_write_concern(request.app.database["users"], "create_users_bulk")
+    return await bulk_insert(request, users, User, user_document, chunk_size)
 
 @router.get("/U", response_description="Get all Users", response_model=List[User])
-def list_users(request: Request, limit: int = 0, skip: int = 0):
-    req={}
-    if limit <=0:
-        if skip  <=0:
-            users = list(request.app.database["users"].find(req))
-        else:
-            users = list(request.app.database["users"].find(req).skip(skip))
-    else:
-        if skip  <=0:
-            users = list(request.app.database["users"].find(req).limit(limit))
-        else:
-            users = list(request.app.database["users"].find(req).skip(skip).limit(limit))
-    return users
+def list_users(request: Request, limit: int = 0, after: str = None, stream: bool = False):
+    if wants_stream(request, stream):
+        cursor = find_sorted(request.app.database["users"], {}, USERS_SORT, after)
+        return ndjson_response(cursor.limit(max(limit, 0)))
+    users, next_token = find_page(request.app.database["users"], {}, USERS_SORT, limit, after)
+    return MongoJSONResponse(users, headers={NEXT_TOKEN_HEADER: next_token} if next_token else None)
 
 @router.get("/T", response_description="Get all tours", response_model=List[Tour])
-def list_tours(request: Request, start_date_From: str=None, start_date_To: str=None, min_price: float=None, max_price: float=None, location: str=None):
-    request.app.database["tours"].create_index([("start_date", 1)])
-    request.app.database["tours"].create_index([("price_per_person", 1)])
-    request.app.database["tours"].create_index([("location", TEXT)])
-    req={}
-    if start_date_From!=None and start_date_To!=None:
-        start_date_From=datetime.strptime(start_date_From, "%Y-%m-%d %H:%M:%S.%f")
-        start_date_To=datetime.strptime(start_date_To, "%Y-%m-%d %H:%M:%S.%f")
-        req['start_date']={"$gte": start_date_From,"$lte": start_date_To}
-    elif min_price!=None and max_price!=None:
-        req['price_per_person']={"$gte": min_price,"$lte": max_price}
-    elif location!=None:
-            req['$text']={"$search": location}
-
-    tours = list(request.app.database["tours"].find(req))
-    return tours
+def list_tours(request: Request, start_date_From: str=None, start_date_To: str=None, min_price: float=None, max_price: float=None, location: str=None, sort: str=None, fields: str=None, limit: int = 0, after: str = None, stream: bool = False):
+    req, sort, projection = tours_query(start_date_From, start_date_To, min_price, max_price, location, sort, fields)
+    if wants_stream(request, stream):
+        cursor = find_sorted(request.app.database["tours"], req, sort, after, projection)
+        return ndjson_response(cursor.limit(max(limit, 0)))
+    tours, next_token = find_page(request.app.database["tours"], req, sort, limit, after, projection)
+    return MongoJSONResponse(tours, headers={NEXT_TOKEN_HEADER: next_token} if next_token else None)
+
+@router.get("/T/explain", response_description="Query plan of GET /T for the same parameters")
+def explain_tours(request: Request, start_date_From: str=None, start_date_To: str=None, min_price: float=None, max_price: float=None, location: str=None, sort: str=None, fields: str=None, limit: int = 0, after: str = None):
+    req, sort, projection = tours_query(start_date_From, start_date_To, min_price, max_price, location, sort, fields)
+    cursor = find_sorted(request.app.database["tours"], req, sort, after, projection).limit(max(limit, 0))
+    summary = summarize_explain(cursor.explain())
+    return jsonable_encoder({"filter": req, "sort": sort, "projection": projection, **summary})
+
 @router.get("/T/general_info", response_description="Get general info")
 def general_info_tours(request: Request):
-    req=[{"$group": {"_id": "$tour_name", "totalQuantity": { "$sum": 1 }, "average_price_per_person": { "$avg": "$price_per_person" }, "average_max_participants": { "$avg": "$max_participants" } }}]
-    tours_info = list(request.app.database["tours"].aggregate(req))
-    return tours_info
+    # Read from the summary kept by the write routes instead of aggregating every tour
+    summaries = request.app.database[mongosummary.SUMMARY_COLLECTION].find({}).sort("_id")
+    return MongoJSONResponse([mongosummary.general_info(summary) for summary in summaries])
+
+@router.get("/T/search", response_description="Tours whose name or location match every word of q (as prefixes)")
+def search_tours(request: Request, q: str, limit: int = DEFAULT_SEARCH_LIMIT):
+    # Served by the in-memory index kept by the tour write routes, Mongo is not queried
+    return MongoJSONResponse(request.app.tour_search.search(q, limit))
+
+@router.get("/T/suggest", response_description="Indexed words starting with the last word of q")
+def suggest_tours(request: Request, q: str, limit: int = 10):
+    return MongoJSONResponse(request.app.tour_search.suggest(q, limit))
 
 @router.get("/T/{id}", response_description="Get a single tour by id", response_model=Tour)
 def find_tour(id: str, request: Request):
     if (tour := request.app.database["tours"].find_one({"_id": id})) is not None:
-        return tour
+        return MongoJSONResponse(tour)
 
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Tour with ID {id} not found")
 
 
 @router.put("/T/{id}", response_description="Update a tour by id", response_model=Tour)
 def update_tour(id: str, request: Request, tour: ToursUpdate = Body(...)):
-    new_data = tour.dict(exclude_unset=True)
-    request.app.database["tours"].update_one({"_id": id}, {"$set": new_data})
-    updated_tour = request.app.database["tours"].find_one({"_id": id})
-    return updated_tour
+    new_data = tour_update(tour)
+    # The old document feeds the summary delta, the new one is rebuilt from it locally
+    old_tour = with_write_concern(request.app.database["tours"], "update_tour").find_one_and_update(
+        {"_id": id}, {"$set": new_data}, return_document=ReturnDocument.BEFORE
+    )
+    if old_tour is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Tour with ID {id} not found")
+    updated_tour = {**old_tour, **new_data}
+    mongosummary.apply(request.app.database, added=[updated_tour], removed=[old_tour])
+    request.app.tour_search.add(updated_tour)
+    return MongoJSONResponse(updated_tour)
 
 
 @router.delete("/T/{id}", response_description="Delete a tour")
 def delete_tour(id: str, request: Request):
-    request.app.database["tours"].delete_one({"_id": id})
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    old_tour = with_write_concern(request.app.database["tours"], "delete_tour").find_one_and_delete({"_id": id})
+    if old_tour is not None:
+        mongosummary.apply(request.app.database, removed=[old_tour])
+        request.app.tour_search.remove(id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
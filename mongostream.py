@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import os
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from mongobulk import NDJSON_MEDIA_TYPE
+from mongojson import dumps
+
+# Documents fetched per getMore while streaming, bounds the server memory per response
+STREAM_BATCH_SIZE = int(os.getenv('MONGODB_STREAM_BATCH_SIZE', '500'))
+
+
+def wants_stream(request: Request, stream: bool):
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _ndjson_lines(cursor):
+    try:
+        for doc in cursor:
+            yield dumps(doc) + b"\n"
+    finally:
+        cursor.close()
+
+
+async def _ndjson_lines_async(cursor):
+    try:
+        async for doc in cursor:
+            yield dumps(doc) + b"\n"
+    finally:
+        await cursor.close()
+
+
+def ndjson_response(cursor, batch_size=STREAM_BATCH_SIZE):
+    """Streams the cursor as NDJSON, one document per line, without materializing it."""
+    return StreamingResponse(_ndjson_lines(cursor.batch_size(batch_size)), media_type=NDJSON_MEDIA_TYPE)
+
+
+def ndjson_response_async(cursor, batch_size=STREAM_BATCH_SIZE):
+    """ndjson_response for a motor cursor."""
+    return StreamingResponse(_ndjson_lines_async(cursor.batch_size(batch_size)), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import argparse
+import os
+from pymongo import MongoClient, UpdateOne
+
+# Per tour_name totals behind GET /tours/T/general_info, kept current by the tour write
+# routes. The updates are not transactional with the tour writes, run rebuild to recover.
+SUMMARY_COLLECTION = "tours_summary"
+
+REBUILD_PIPELINE = [
+    {"$group": {
+        "_id": "$tour_name",
+        "count": {"$sum": 1},
+        "price_sum": {"$sum": "$price_per_person"},
+        "max_participants_sum": {"$sum": "$max_participants"},
+    }},
+    {"$out": SUMMARY_COLLECTION},
+]
+
+
+def summary_updates(added=(), removed=()):
+    """$inc operations moving the summary from the removed tours to the added ones.
+    Missing or null prices and participants count as 0, as $sum does in the rebuild."""
+    deltas = {}
+    for docs, sign in ((added, 1), (removed, -1)):
+        for doc in docs:
+            delta = deltas.setdefault(doc["tour_name"], {"count": 0, "price_sum": 0, "max_participants_sum": 0})
+            delta["count"] += sign
+            delta["price_sum"] += sign * (doc.get("price_per_person") or 0)
+            delta["max_participants_sum"] += sign * (doc.get("max_participants") or 0)
+    return [
+        UpdateOne({"_id": name}, {"$inc": delta}, upsert=True)
+        for name, delta in deltas.items()
+        if any(delta.values())
+    ]
+
+
+def apply(database, added=(), removed=()):
+    ops = summary_updates(added, removed)
+    if not ops:
+        return
+    database[SUMMARY_COLLECTION].bulk_write(ops, ordered=False)
+    if removed:
+        database[SUMMARY_COLLECTION].delete_many({"_id": {"$in": [doc["tour_name"] for doc in removed]}, "count": {"$lte": 0}})
+
+
+async def apply_async(database, added=(), removed=()):
+    """apply for a motor database."""
+    ops = summary_updates(added, removed)
+    if not ops:
+        return
+    await database[SUMMARY_COLLECTION].bulk_write(ops, ordered=False)
+    if removed:
+        await database[SUMMARY_COLLECTION].delete_many({"_id": {"$in": [doc["tour_name"] for doc in removed]}, "count": {"$lte": 0}})
+
+
+def general_info(summary):
+    """Summary document in the shape general_info_tours always returned."""
+    return {
+        "_id": summary["_id"],
+        "totalQuantity": summary["count"],
+        "average_price_per_person": summary["price_sum"] / summary["count"],
+        "average_max_participants": summary["max_participants_sum"] / summary["count"],
+    }
+
+
+def rebuild(database):
+    """Recomputes the whole summary from the tours collection ($out swaps it atomically)."""
+    database["tours"].aggregate(REBUILD_PIPELINE)
+    return database[SUMMARY_COLLECTION].count_documents({})
+
+
+async def rebuild_async(database):
+    """rebuild for a motor database (the $out stage runs once the cursor is read)."""
+    await database["tours"].aggregate(REBUILD_PIPELINE).to_list(None)
+    return await database[SUMMARY_COLLECTION].count_documents({})
+
+
+def ensure_summary(database):
+    """Builds the summary of a database that has none yet (first start after deploying it).
+    Returns the number of tour names rebuilt, None when it already existed."""
+    if database[SUMMARY_COLLECTION].find_one({}, {"_id": 1}) is not None:
+        return None
+    return rebuild(database)
+
+
+async def ensure_summary_async(database):
+    """ensure_summary for a motor database."""
+    if await database[SUMMARY_COLLECTION].find_one({}, {"_id": 1}) is not None:
+        return None
+    return await rebuild_async(database)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintenance of the tours summary collection")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017'))
+    database = client[os.getenv('MONGODB_DB_NAME', 'Proyect')]
+    print(f"Rebuilt {SUMMARY_COLLECTION}: {rebuild(database)} tour names")
+    client.close()
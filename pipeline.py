@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import logging
+import os
+import queue
+import threading
+import time
+
+log = logging.getLogger()
+
+# Records per queue item and items per queue, a full queue blocks its reader (backpressure)
+PIPELINE_BATCH_SIZE = int(os.getenv('PIPELINE_BATCH_SIZE', '500'))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '20'))
+
+_END = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.records = 0
+        self.seconds = 0.0
+        self.blocked = 0.0   # seconds spent waiting on full queues (sources only)
+        self.error = None
+
+    def __str__(self):
+        rate = self.records / self.seconds if self.seconds else 0
+        text = f"{self.name}: {self.records} records in {self.seconds:.1f}s ({rate:.0f}/s)"
+        if self.blocked:
+            text += f", {self.blocked:.1f}s blocked by slower stages"
+        if self.error is not None:
+            text += f", failed: {self.error}"
+        return text
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _read(records, queues, stats, batch_size):
+    """Parses a source once and puts every batch on the queue of each stage using it."""
+    start = time.perf_counter()
+    try:
+        for batch in _batches(records, batch_size):
+            stats.records += len(batch)
+            for q in queues:
+                put_start = time.perf_counter()
+                q.put(batch)
+                stats.blocked += time.perf_counter() - put_start
+    except Exception as e:
+        stats.error = e
+        log.error(f"Error reading {stats.name}: {e}")
+    finally:
+        for q in queues:
+            q.put(_END)
+        stats.seconds = time.perf_counter() - start
+
+
+def _drain(q, stats):
+    while True:
+        batch = q.get()
+        if batch is _END:
+            return
+        stats.records += len(batch)
+        yield from batch
+
+
+def _write(fn, queues, stats):
+    start = time.perf_counter()
+    iterators = [_drain(q, stats) for q in queues]
+    try:
+        fn(*iterators)
+    except Exception as e:
+        stats.error = e
+        log.error(f"Error in stage {stats.name}: {e}")
+    finally:
+        # Whatever the stage left unread is discarded so the readers never block on it
+        consumed = stats.records
+        for iterator in iterators:
+            for _ in iterator:
+                pass
+        stats.records = consumed
+        stats.seconds = time.perf_counter() - start
+
+
+def run(sources, stages, batch_size=PIPELINE_BATCH_SIZE, queue_size=PIPELINE_QUEUE_SIZE):
+    """Reads every source once and fans its records out to the stages using it, each
+    source and each stage on its own thread, connected by bounded queues.
+
+    sources: {name: iterable of records}
+    stages: {name: (fn, [source names])}, fn is called with one iterator per source it
+    uses, in the order of sources (so that two stages never wait on each other's source).
+    Records are shared between stages and must not be modified.
+    Returns {name: StageStats} for the sources and the stages."""
+    order = list(sources)
+    queues = {name: [] for name in order}
+    threads, stats = [], {}
+    for name, (fn, used) in stages.items():
+        stage_queues = []
+        for source in sorted(used, key=order.index):
+            q = queue.Queue(maxsize=queue_size)
+            queues[source].append(q)
+            stage_queues.append(q)
+        stats[name] = StageStats(name)
+        threads.append(threading.Thread(target=_write, args=(fn, stage_queues, stats[name]), name=f"stage-{name}"))
+    for name in order:
+        stats[name] = StageStats(name)
+        threads.append(threading.Thread(target=_read, args=(sources[name], queues[name], stats[name], batch_size),
+                                        name=f"source-{name}"))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for stage_stats in stats.values():
+        log.info(str(stage_stats))
+        print(stage_stats)
+    log.info(f"Pipeline finished in {elapsed:.1f}s")
+    print(f"Pipeline finished in {elapsed:.1f}s")
+    return stats
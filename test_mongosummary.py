@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+from mongobulk import tour_update
+from mongomodel import ToursUpdate
+from mongosummary import summary_updates
+
+TOUR = {"_id": "t1", "tour_name": "Epic Quest", "price_per_person": 100.0, "max_participants": 10}
+
+
+def test_null_fields_are_not_written():
+    body = dict.fromkeys(ToursUpdate.__fields__, None)
+    update = tour_update(ToursUpdate.parse_obj({**body, "location": "Tokyo"}))
+    assert update == {"location": "Tokyo"}
+
+
+def test_null_fields_count_as_zero():
+    stored = {**TOUR, "price_per_person": None, "max_participants": None}
+    ops = summary_updates(added=[stored], removed=[TOUR])
+    assert [op._doc for op in ops] == [{"$inc": {"count": 0, "price_sum": -100.0, "max_participants_sum": -10}}]
+    ops = summary_updates(removed=[stored])
+    assert [op._doc for op in ops] == [{"$inc": {"count": -1, "price_sum": 0, "max_participants_sum": 0}}]
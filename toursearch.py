@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+
+# Score of a query term found in each field, doubled when the whole word matches
+FIELD_WEIGHTS = {"tour_name": 2.0, "location": 3.0}
+# Fields returned by the search, read from Mongo once when the index is built
+RESULT_FIELDS = ("_id", "tour_name", "location", "duration_days", "price_per_person", "start_date", "end_date")
+DEFAULT_SEARCH_LIMIT = 20
+# Postings longer than this keep their documents ranked once a search reads them
+RANKED_MIN_POSTINGS = 64
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lower case words of text, accents removed ('Zürich' -> ['zurich'])."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return _WORD.findall(text.lower())
+
+
+class TourSearchIndex:
+    """Inverted index over tour_name and location with prefix matching, held in memory
+    by every API process and kept current by its write routes (writes made by other
+    processes or directly in Mongo show up on the next start).
+
+    Documents get small integer ids. Postings map a term to {doc id: weight}, and the
+    sorted term list works as the prefix trie: the terms starting with a prefix are a
+    contiguous slice found with bisect. Long postings read by a search are also kept
+    in rank order, so one word queries merge the best matches of each term instead of
+    scoring all of them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}       # doc id -> result document
+        self._doc_terms = {}  # doc id -> {term: weight}
+        self._ids = {}        # tour _id -> doc id
+        self._postings = {}   # term -> {doc id: weight}
+        self._terms = []      # sorted postings keys
+        self._ranked = {}     # term -> sorted [(-weight, tour_name, doc id)], long postings read by search
+        self._next_id = 0
+
+    @classmethod
+    def from_documents(cls, tours):
+        index = cls()
+        index.add_many(tours)
+        return index
+
+    @classmethod
+    async def from_cursor_async(cls, cursor):
+        index = cls()
+        tours = []
+        async for tour in cursor:
+            tours.append(tour)
+            if len(tours) >= 10000:
+                index.add_many(tours)
+                tours = []
+        index.add_many(tours)
+        return index
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, tour):
+        """Indexes a tour document, replacing the previous version with the same _id."""
+        with self._lock:
+            for term in self._add(tour):
+                bisect.insort(self._terms, term)
+
+    def add_many(self, tours):
+        """add for a batch: the new terms are sorted once and merged into the term list."""
+        with self._lock:
+            new_terms = []
+            for tour in tours:
+                new_terms.extend(self._add(tour))
+            if new_terms:
+                new_terms.sort()
+                self._terms = list(heapq.merge(self._terms, new_terms)) if self._terms else new_terms
+
+    def _add(self, tour):
+        """Indexes the tour, returns the terms it added to the postings (not yet in _terms)."""
+        terms = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(tour.get(field, "")):
+                terms[term] = max(terms.get(term, 0), weight)
+        doc = {field: tour[field] for field in RESULT_FIELDS if field in tour}
+        self._remove(tour["_id"])
+        doc_id = self._next_id
+        self._next_id += 1
+        self._ids[tour["_id"]] = doc_id
+        self._docs[doc_id] = doc
+        self._doc_terms[doc_id] = terms
+        new_terms = []
+        for term, weight in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                new_terms.append(term)
+            postings[doc_id] = weight
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                bisect.insort(ranked, (-weight, doc.get("tour_name", ""), doc_id))
+        return new_terms
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        doc_id = self._ids.pop(id, None)
+        if doc_id is None:
+            return
+        name = self._docs.pop(doc_id).get("tour_name", "")
+        for term, weight in self._doc_terms.pop(doc_id).items():
+            postings = self._postings[term]
+            del postings[doc_id]
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                del ranked[bisect.bisect_left(ranked, (-weight, name, doc_id))]
+            if not postings:
+                del self._postings[term]
+                self._ranked.pop(term, None)
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _prefixed(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + "\uffff", start)
+        return self._terms[start:end]
+
+    def _ranked_postings(self, term):
+        """[(-weight, tour_name, doc id)] of a long postings, best first."""
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            ranked = self._ranked[term] = sorted((-weight, self._docs[doc_id].get("tour_name", ""), doc_id)
+                                                 for doc_id, weight in self._postings[term].items())
+        return ranked
+
+    def _word_score(self, doc_id, word):
+        """Best weight of the terms of the document starting with word, exact words counting double."""
+        return max((weight * (2.0 if term == word else 1.0)
+                    for term, weight in self._doc_terms[doc_id].items() if term.startswith(word)), default=0)
+
+    def search(self, q, limit=DEFAULT_SEARCH_LIMIT):
+        """Tours matching every word of q, each word as a prefix ('bar' finds Barcelona).
+        Ranked by the summed weight of the fields matched, exact words counting double,
+        then by tour_name."""
+        words = tokenize(q)
+        if not words:
+            return []
+        limit = max(limit, 1)
+        with self._lock:
+            if len(words) == 1:
+                # Long postings are merged from their rank lists, the short ones ranked here:
+                # the first time a document shows up is its best score, stop at limit documents
+                word = words[0]
+                ranked, short = [], {}
+                for term in self._prefixed(word):
+                    boost = 2.0 if term == word else 1.0
+                    postings = self._postings[term]
+                    if len(postings) > RANKED_MIN_POSTINGS:
+                        ranked.append((rank * boost, name, doc_id) for rank, name, doc_id in self._ranked_postings(term))
+                    else:
+                        for doc_id, weight in postings.items():
+                            short[doc_id] = min(short.get(doc_id, 0), -weight * boost)
+                short = heapq.nsmallest(limit, ((rank, self._docs[doc_id].get("tour_name", ""), doc_id)
+                                                for doc_id, rank in short.items()))
+                merged = heapq.merge(short, *ranked)
+                found = {}
+                for _, _, doc_id in merged:
+                    found.setdefault(doc_id, None)
+                    if len(found) == limit:
+                        break
+                return [self._docs[doc_id] for doc_id in found]
+            # Intersected from the word with the fewest postings: each next word adds the scores of
+            # its postings, or of the terms of the remaining documents when those are fewer
+            prefixed = {word: self._prefixed(word) for word in words}
+            sizes = {word: sum(len(self._postings[term]) for term in prefixed[word]) for word in words}
+            scores = None
+            for word in sorted(words, key=sizes.get):
+                if scores is not None and len(scores) * 4 < sizes[word]:
+                    scores = {doc_id: score + word_score for doc_id, score in scores.items()
+                              if (word_score := self._word_score(doc_id, word))}
+                else:
+                    word_scores = {}
+                    for term in prefixed[word]:
+                        boost = 2.0 if term == word else 1.0
+                        for doc_id, weight in self._postings[term].items():
+                            word_scores[doc_id] = max(word_scores.get(doc_id, 0), weight * boost)
+                    if scores is None:
+                        scores = word_scores
+                    else:
+                        scores = {doc_id: score + word_scores[doc_id] for doc_id, score in scores.items() if doc_id in word_scores}
+                if not scores:
+                    return []
+            ranked = heapq.nsmallest(limit, scores.items(),
+                                     key=lambda item: (-item[1], self._docs[item[0]].get("tour_name", "")))
+            return [self._docs[doc_id] for doc_id, _ in ranked]
+
+    def suggest(self, prefix, limit=10):
+        """Indexed words starting with prefix, the most frequent first."""
+        words = tokenize(prefix)
+        if not words:
+            return []
+        with self._lock:
+            terms = self._prefixed(words[-1])
+            terms.sort(key=lambda term: -len(self._postings[term]))
+            return terms[:limit]